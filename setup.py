@@ -51,5 +51,8 @@ setup(name='threedi-verification',
       entry_points={
           'console_scripts': [
               'verify = threedi_verification.verification:main',
+              'fake_simulator = threedi_verification.fake_simulator:main',
+              ('fake_testbank = '
+               'threedi_verification.fake_simulator:testbank_main'),
           ]},
       )
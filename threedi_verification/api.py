@@ -0,0 +1,236 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Read-only json api for Jenkins jobs and dashboards.
+
+The lists use keyset pagination: pass the ``next`` url of the previous page
+(``?after=<last id>``) instead of an offset, so every page is one cheap
+indexed query. ``?fields=a,b`` selects the fields; the default leaves out
+the heavy ones. The logs are never included, use ``log_url``. Responses
+have an ETag, so pollers can use ``If-None-Match``.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+from collections import OrderedDict
+import json
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.urlresolvers import reverse
+from django.db.models import Count
+from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import condition
+
+from threedi_verification.models import LibraryVersion
+from threedi_verification.models import TestCase
+from threedi_verification.models import TestRun
+from threedi_verification.models import run_counts
+from threedi_verification.views import page_etag
+from threedi_verification.views import page_last_modified
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class Resource(object):
+    """Description of what the api offers of a model."""
+    model = None
+    # {api field name: orm lookup}
+    fields = OrderedDict()
+    default_fields = ()
+    # {query parameter: orm lookup}
+    filters = {}
+    json_fields = ()
+    url_name = None
+
+    def __init__(self, request):
+        self.request = request
+
+    def selected_fields(self):
+        """Return the requested fields; raise ValueError for unknown ones."""
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return list(self.default_fields)
+        names = [name.strip() for name in requested.split(',')
+                 if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError("Unknown fields: %s (available: %s)" % (
+                ', '.join(unknown), ', '.join(self.fields)))
+        return names
+
+    def queryset(self):
+        queryset = self.model.objects.all()
+        for parameter, lookup in self.filters.items():
+            if parameter in self.request.GET:
+                value = self.request.GET[parameter]
+                if value in ('true', 'false'):
+                    value = (value == 'true')
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def row_to_dict(self, names, row):
+        result = OrderedDict([('id', row['id'])])
+        for name in names:
+            value = row[self.fields[name]]
+            if name in self.json_fields and isinstance(value, basestring):
+                # values() gives us the raw json of a JSONField.
+                value = json.loads(value)
+            result[name] = value
+        result['url'] = reverse(self.url_name, kwargs={'pk': row['id']})
+        return self.extra(result)
+
+    def extra(self, result):
+        return result
+
+    def integer_parameter(self, name, default=None):
+        """Return the query parameter as int; raise ValueError if it isn't.
+        """
+        value = self.request.GET.get(name)
+        if not value:
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError("%s must be an integer, not %r" % (name, value))
+
+    def page(self):
+        names = self.selected_fields()
+        limit = max(1, min(self.integer_parameter('limit', DEFAULT_LIMIT),
+                           MAX_LIMIT))
+        queryset = self.queryset().order_by('id')
+        after = self.integer_parameter('after')
+        if after is not None:
+            queryset = queryset.filter(id__gt=after)
+        lookups = ['id'] + [self.fields[name] for name in names]
+        # One extra row tells us whether there's a next page.
+        rows = list(queryset.values(*lookups)[:limit + 1])
+        results = [self.row_to_dict(names, row) for row in rows[:limit]]
+        next_url = None
+        if len(rows) > limit:
+            parameters = self.request.GET.copy()
+            parameters['after'] = results[-1]['id']
+            next_url = '%s?%s' % (self.request.path, parameters.urlencode())
+        return OrderedDict([('next', next_url), ('results', results)])
+
+
+class LibraryVersionResource(Resource):
+    model = LibraryVersion
+    fields = OrderedDict([
+        ('library', 'library'),
+        ('last_modified', 'last_modified'),
+        ('num_test_cases', 'num_test_cases'),
+        ('is_tagged', 'is_tagged'),
+    ])
+    default_fields = ('library', 'last_modified', 'num_test_cases')
+    filters = {'library': 'library',
+               'is_tagged': 'is_tagged'}
+    url_name = 'threedi_verification.library_version'
+
+    def extra(self, result):
+        result['status_url'] = reverse(
+            'threedi_verification.api.library_version_status',
+            kwargs={'pk': result['id']})
+        return result
+
+
+class TestCaseResource(Resource):
+    model = TestCase
+    fields = OrderedDict([
+        ('path', 'path'),
+        ('library', 'library'),
+        ('pretty_name', 'pretty_name'),
+        ('category', 'category'),
+        ('info', 'info'),
+        ('has_csv', 'has_csv'),
+        ('is_active', 'is_active'),
+        ('latest_run', 'latest_run'),
+    ])
+    default_fields = ('path', 'library', 'pretty_name', 'category',
+                      'is_active', 'latest_run')
+    filters = {'library': 'library',
+               'category': 'category',
+               'is_active': 'is_active'}
+    url_name = 'threedi_verification.test_case'
+
+
+class TestRunResource(Resource):
+    model = TestRun
+    fields = OrderedDict([
+        ('test_case', 'test_case_version__test_case'),
+        ('test_case_version', 'test_case_version'),
+        ('library_version', 'library_version'),
+        ('run_started', 'run_started'),
+        ('duration', 'duration'),
+        ('status', 'status'),
+        ('has_crashed', 'has_crashed'),
+        ('num_right', 'num_right'),
+        ('num_wrong', 'num_wrong'),
+        ('num_errored', 'num_errored'),
+        ('timing', 'timing'),
+        ('max_rss', 'max_rss'),
+        ('user_time', 'user_time'),
+        ('system_time', 'system_time'),
+        ('profile', 'profile'),
+        ('report', 'report'),
+    ])
+    default_fields = ('test_case', 'library_version', 'run_started',
+                      'duration', 'status', 'has_crashed', 'num_right',
+                      'num_wrong', 'num_errored')
+    filters = {'library_version': 'library_version',
+               'test_case': 'test_case_version__test_case',
+               'status': 'status',
+               'has_crashed': 'has_crashed'}
+    json_fields = ('timing', 'profile', 'report')
+    url_name = 'threedi_verification.test_run'
+
+    def extra(self, result):
+        result['log_url'] = reverse('threedi_verification.log',
+                                    kwargs={'pk': result['id']})
+        return result
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder),
+                        status=status,
+                        content_type='application/json')
+
+
+def list_view(resource_class):
+    @condition(etag_func=page_etag, last_modified_func=page_last_modified)
+    def view(request):
+        try:
+            return json_response(resource_class(request).page())
+        except ValueError as e:
+            return json_response({'error': unicode(e)}, status=400)
+    return view
+
+
+library_versions = list_view(LibraryVersionResource)
+test_cases = list_view(TestCaseResource)
+test_runs = list_view(TestRunResource)
+
+
+@condition(etag_func=page_etag, last_modified_func=page_last_modified)
+def library_version_status(request, pk=None):
+    """Return the aggregate result of a library version in two queries."""
+    library_version = get_object_or_404(LibraryVersion.objects.annotate(
+        num_test_runs=Count('test_runs')), pk=pk)
+    counts = run_counts([library_version.id])[library_version.id]
+    is_fully_tested = library_version.is_fully_tested()
+    return json_response(OrderedDict([
+        ('id', library_version.id),
+        ('library', library_version.library),
+        ('last_modified', library_version.last_modified),
+        ('num_test_cases', library_version.num_test_cases),
+        ('num_test_runs', library_version.num_test_runs),
+        ('is_fully_tested', is_fully_tested),
+        ('crashes', counts['crashes']),
+        ('wrong', counts['wrong']),
+        ('right', counts['right']),
+        ('passed', (is_fully_tested and not counts['crashes'] and
+                    not counts['wrong'])),
+    ]))
@@ -0,0 +1,201 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Benchmarks of the checks, on synthetic netcdfs (see synthetic.py).
+
+Every benchmark reports its duration, the number of checks per second and
+the peak memory (max rss) of the process so far. The html export of the
+resulting reports is timed with a cold and a warm template cache. The
+results can be saved as a baseline (json) and later runs compared against
+it.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
+from jinja2 import PackageLoader
+
+from threedi_verification import synthetic
+from threedi_verification import verification
+
+logger = logging.getLogger(__name__)
+
+SIZES = synthetic.SIZES
+BENCHMARK_DIR = os.path.join(settings.BUILDOUT_DIR, 'var', 'benchmarks')
+DEFAULT_TOLERANCE = 20  # percent
+
+
+def peak_rss_mb():
+    """Return the max rss of this process in MB."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss / 1024 / 1024  # bytes
+    return max_rss / 1024  # kilobytes
+
+
+def _result(seconds, checks=None):
+    result = OrderedDict([('seconds', round(seconds, 4)),
+                          ('peak_rss_mb', round(peak_rss_mb(), 1))])
+    if checks is not None:
+        result['checks'] = checks
+        result['checks_per_second'] = round(checks / seconds, 2)
+    return result
+
+
+def benchmark_checks(model_dir, csv_filename, mdu_reports=None):
+    """Run the checks of one csv like run_subgrid_simulation does.
+
+    The MduReport is appended to ``mdu_reports``, if given.
+    """
+    original_dir = os.getcwd()
+    os.chdir(model_dir)
+    try:
+        is_his = 'his' in csv_filename
+        netcdf_path = is_his and 'subgrid_his.nc' or 'subgrid_map.nc'
+        report = verification.MduReport(
+            os.path.join(model_dir, 'benchmark.mdu'), test_run_id='benchmark')
+        start_time = time.time()
+        verification.check_csv(csv_filename, netcdf_path, mdu_report=report,
+                               is_his=is_his)
+        seconds = time.time() - start_time
+    finally:
+        os.chdir(original_dir)
+    if mdu_reports is not None:
+        mdu_reports.append(report)
+    reports = report.instruction_reports.values()
+    failed = [instruction_report for instruction_report in reports
+              if not instruction_report.equal]
+    if failed:
+        logger.warn("%s of %s checks in %s failed, for instance: %s",
+                    len(failed), len(reports), csv_filename,
+                    failed[0].log or failed[0].found)
+    return _result(seconds, checks=len(reports))
+
+
+@contextmanager
+def _export_to(outdir, environment):
+    """Let verification write its html into outdir, using the environment.
+    """
+    names = ('OUTDIR', 'ARCHIVEDIR', 'TIMESTAMPED_OUTDIR', 'jinja_env')
+    originals = dict((name, getattr(verification, name)) for name in names)
+    verification.OUTDIR = outdir
+    verification.ARCHIVEDIR = os.path.join(outdir, 'archive')
+    verification.TIMESTAMPED_OUTDIR = os.path.join(verification.ARCHIVEDIR,
+                                                   'benchmark')
+    verification.jinja_env = environment
+    os.makedirs(verification.ARCHIVEDIR)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(verification, name, value)
+
+
+def benchmark_export(mdu_reports):
+    """Time Report.export_reports() with a cold and a warm bytecode cache.
+
+    Both exports start with an empty output directory, so every page is
+    rendered; the second one finds the compiled templates in the cache.
+    """
+    cache_dir = tempfile.mkdtemp()
+    try:
+        result = OrderedDict()
+        for name in ['export_cold', 'export_warm']:
+            report = verification.Report()
+            for index, mdu_report in enumerate(mdu_reports):
+                # The details filename is derived from the test bank path.
+                mdu_id = '/benchmark/%s/%s.mdu' % (
+                    settings.TESTCASES_ROOT_NAME, index)
+                report.mdu_reports[mdu_id] = mdu_report
+            environment = Environment(
+                loader=PackageLoader('threedi_verification', 'templates'),
+                bytecode_cache=FileSystemBytecodeCache(cache_dir))
+            outdir = tempfile.mkdtemp()
+            try:
+                with _export_to(outdir, environment):
+                    start_time = time.time()
+                    report.export_reports(workers=1)
+                    result[name] = _result(time.time() - start_time)
+            finally:
+                shutil.rmtree(outdir)
+        return result
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def run_benchmarks(size='small', checks=20, workdir=None):
+    """Generate the synthetic model and run all benchmarks on it."""
+    dimensions = SIZES[size]
+    if workdir is None:
+        # Inside the buildout, as the plots are stored relative to it.
+        workdir = os.path.join(BENCHMARK_DIR, size)
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    os.makedirs(workdir)
+
+    results = OrderedDict()
+    start_time = time.time()
+    synthetic.write_results(workdir, **dimensions)
+    synthetic.write_csvs(workdir, checks=checks, **dimensions)
+    results['generate'] = _result(time.time() - start_time)
+    logger.info("Generated %s model in %s", size, workdir)
+
+    mdu_reports = []
+    for csv_filename in synthetic.MAP_CSVS + synthetic.HIS_CSVS:
+        name = 'check_%s' % os.path.splitext(csv_filename)[0]
+        results[name] = benchmark_checks(workdir, csv_filename,
+                                         mdu_reports=mdu_reports)
+        logger.info("%s: %s", name, results[name])
+    results.update(benchmark_export(mdu_reports))
+    return results
+
+
+def save_baseline(results, path):
+    dir_path = os.path.dirname(path)
+    if dir_path and not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    with open(path, 'w') as baseline_file:
+        json.dump(results, baseline_file, indent=2)
+
+
+def load_baseline(path):
+    with open(path) as baseline_file:
+        return json.load(baseline_file, object_pairs_hook=OrderedDict)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return (lines, regressed) for the results versus the baseline.
+
+    A benchmark regressed if it got more than ``tolerance`` percent slower
+    or used more than ``tolerance`` percent more memory.
+    """
+    lines = []
+    regressed = False
+    for name, result in results.items():
+        if name not in baseline:
+            lines.append("%-28s (not in baseline)" % name)
+            continue
+        for key in ['seconds', 'peak_rss_mb']:
+            old = baseline[name][key]
+            new = result[key]
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            is_worse = change > tolerance
+            regressed = regressed or is_worse
+            lines.append("%-28s %-12s %10s -> %10s (%+.1f%%)%s" % (
+                name, key, old, new, change,
+                is_worse and "  REGRESSION" or ""))
+    return lines, regressed
@@ -0,0 +1,240 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Fake simulator for load testing the harness without the 3Di libraries.
+
+``bin/fake_simulator`` can stand in for ``bin/simplesubgrid <mdu>`` and for
+``bin/pyflow <ini> -m -o debug``: point ``SUBGRID_SIMULATOR`` and/or
+``FLOW_SIMULATOR`` in your localsettings.py at it, optionally with options
+(a relative path is relative to the buildout directory)::
+
+    SUBGRID_SIMULATOR = 'bin/fake_simulator --seconds 5 --error-rate 0.1'
+
+It reads the model file, sleeps (or with ``--burn``, uses the cpu) and
+writes a ``subgrid_map.nc`` and ``subgrid_his.nc`` (see synthetic.py) where
+the real simulator would: next to the mdu, or in ``<ini name>/results/``.
+It can also fail like the real one does: an error message ending in
+"quitting", a segmentation fault or hanging forever.
+
+A ``[fake]`` section in the model file overrides the options, so a test
+case can always crash, for instance. ``bin/fake_testbank`` generates a
+test bank with such models plus csvs whose checks pass on the output.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import ConfigParser
+import argparse
+import os
+import random
+import signal
+import sys
+import time
+
+import numpy as np
+
+from threedi_verification import synthetic
+
+OUTCOMES = ('ok', 'error', 'segfault', 'hang')
+DIMENSIONS = ('cells', 'links', 'stations', 'cross_sections', 'timesteps')
+OPTIONS = ('seconds', 'burn', 'memory', 'outcome') + DIMENSIONS
+
+MDU_TEMPLATE = """[geometry]
+BathymetryFile = fake.asc
+
+[grid]
+GridSpace = %(cell_size)s
+kmax = 1
+
+[time]
+Dt = %(time_step)s
+NTimesteps = %(timesteps)s
+
+[fake]
+%(fake)s
+"""
+INI_TEMPLATE = """[settings]
+name = fake
+
+[fake]
+%(fake)s
+"""
+
+
+def model_options(model_path, defaults):
+    """Return the options, overridden by the model's [fake] section."""
+    options = dict(defaults)
+    config = ConfigParser.RawConfigParser()
+    with open(model_path) as model_file:
+        config.readfp(model_file)
+    if config.has_section('fake'):
+        for name in OPTIONS:
+            if not config.has_option('fake', name):
+                continue
+            value = config.get('fake', name).split('#')[0].strip()
+            if name == 'outcome':
+                options[name] = value
+            elif name == 'burn':
+                options[name] = value.lower() in ('1', 'true', 'yes')
+            elif name in DIMENSIONS:
+                options[name] = int(value)
+            else:
+                options[name] = float(value)
+    return options
+
+
+def pick_outcome(options, rng):
+    """Return the outcome: the chosen one or a random one by the rates."""
+    if options.get('outcome'):
+        return options['outcome']
+    draw = rng.random()
+    for outcome in ('error', 'segfault', 'hang'):
+        rate = options['%s_rate' % outcome]
+        if draw < rate:
+            return outcome
+        draw -= rate
+    return 'ok'
+
+
+def spend_time(seconds, burn=False):
+    """Sleep or keep the cpu busy for the number of seconds."""
+    if not burn:
+        time.sleep(seconds)
+        return
+    end_time = time.time() + seconds
+    while time.time() < end_time:
+        sum(index * index for index in range(10000))
+
+
+def result_dir(model_path):
+    """Return where the real simulator would write its netcdfs."""
+    if model_path.endswith('.ini'):
+        return os.path.join(os.path.splitext(model_path)[0], 'results')
+    return os.path.dirname(model_path)
+
+
+def make_flow_dirs(model_path):
+    """Create the results and preprocessed dirs of a flow model."""
+    variant_dir = os.path.splitext(model_path)[0]
+    for name in ('results', 'preprocessed'):
+        directory = os.path.join(variant_dir, name)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+
+def simulate(model_path, options, rng):
+    """Pretend to run the model; return the exit code."""
+    print("Loading model %s" % model_path)
+    sys.stdout.flush()
+    if model_path.endswith('.ini'):
+        # pyflow creates these before it fails, its cleanup step expects them.
+        make_flow_dirs(model_path)
+    outcome = pick_outcome(options, rng)
+    if options['memory']:
+        # Touch the memory so that it counts in the max rss.
+        ballast = np.ones(int(options['memory'] * 1024 * 1024 / 8))
+        print("Allocated %s MB (%s)" % (options['memory'], ballast.size))
+    if outcome == 'hang':
+        print("Starting simulation")
+        sys.stdout.flush()
+        while True:
+            time.sleep(60)
+    spend_time(options['seconds'], burn=options['burn'])
+    if outcome == 'error':
+        # The real simulator exits with 0 in this case, the harness looks
+        # at the last lines of the output.
+        print("Error: fake simulation failed, quitting")
+        return 0
+    if outcome == 'segfault':
+        # Like the shell reports a crashed simulator.
+        print("Segmentation fault (core dumped)", file=sys.stderr)
+        sys.stderr.flush()
+        os.kill(os.getpid(), signal.SIGSEGV)
+    synthetic.write_results(result_dir(model_path),
+                            **dict((name, options[name])
+                                   for name in DIMENSIONS))
+    print("Simulation finished")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fake simplesubgrid/pyflow for load testing.")
+    parser.add_argument('model', help="mdu or ini file")
+    parser.add_argument('--seconds', type=float, default=1.0,
+                        help="duration of the simulation")
+    parser.add_argument('--burn', action='store_true', default=False,
+                        help="use the cpu instead of sleeping")
+    parser.add_argument('--memory', type=float, default=0,
+                        help="MB of memory to allocate")
+    parser.add_argument('--outcome', choices=OUTCOMES, default=None,
+                        help="force an outcome instead of using the rates")
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--segfault-rate', type=float, default=0)
+    parser.add_argument('--hang-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    for name, value in synthetic.SIZES['small'].items():
+        parser.add_argument('--%s' % name.replace('_', '-'), type=int,
+                            default=value)
+    # pyflow's "-m -o debug" are accepted and ignored.
+    args, unknown = parser.parse_known_args()
+    model_path = os.path.abspath(args.model)
+    if not os.path.exists(model_path):
+        print("Error: %s not found, quitting" % args.model)
+        return 1
+    options = model_options(model_path, vars(args))
+    return simulate(model_path, options, random.Random(args.seed))
+
+
+def write_test_case(model_dir, library, index, outcome, dimensions,
+                    checks=20):
+    """Write a model and csvs that pass on the fake simulator's output."""
+    os.makedirs(model_dir)
+    fake = '\n'.join(['outcome = %s' % outcome] +
+                     ['%s = %s' % (name, dimensions[name])
+                      for name in DIMENSIONS])
+    if library == 'flow':
+        model_path = os.path.join(model_dir, 'fake.ini')
+        contents = INI_TEMPLATE % dict(fake=fake)
+    else:
+        model_path = os.path.join(model_dir, 'fake.mdu')
+        contents = MDU_TEMPLATE % dict(
+            cell_size=synthetic.CELL_SIZE, time_step=synthetic.TIME_STEP,
+            timesteps=dimensions['timesteps'], fake=fake)
+    with open(model_path, 'w') as model_file:
+        model_file.write(contents)
+    if library == 'flow':
+        make_flow_dirs(model_path)
+    with open(os.path.join(model_dir, 'index.txt'), 'w') as index_file:
+        index_file.write("Fake test case %s (%s)\n" % (index, outcome))
+    synthetic.write_csvs(model_dir, checks=checks, seed=index, **dimensions)
+    if library == 'flow':
+        # The flow checks only look at the map netcdf.
+        for csv_filename in synthetic.HIS_CSVS:
+            os.remove(os.path.join(model_dir, csv_filename))
+
+
+def testbank_main():
+    parser = argparse.ArgumentParser(
+        description="Generate a test bank for the fake simulator.")
+    parser.add_argument('directory', help="test bank (sub)directory")
+    parser.add_argument('--library', choices=('subgrid', 'flow'),
+                        default='subgrid')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--size', choices=synthetic.SIZES.keys(),
+                        default='small')
+    parser.add_argument('--checks', type=int, default=20)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--segfault-rate', type=float, default=0)
+    parser.add_argument('--hang-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    dimensions = dict(synthetic.SIZES[args.size])
+    for index in range(args.count):
+        # The outcome is fixed per test case, so reruns behave the same.
+        outcome = pick_outcome(vars(args), rng)
+        model_dir = os.path.join(args.directory, 'fake_%05d' % index)
+        write_test_case(model_dir, args.library, index, outcome,
+                        dimensions, checks=args.checks)
+    print("Wrote %s %s test cases to %s" % (
+        args.count, args.library, args.directory))
@@ -0,0 +1,102 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Gzipped storage of the simulator logs, outside of the database.
+
+The logs can be several megabytes. Storing them in the ``TestRun.report``
+json means every query that loads a test run drags them along, so only the
+last few lines are kept in the report and the full log is stored here.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import gzip
+import logging
+import os
+import struct
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def log_path(test_run_id):
+    """Return the path of the gzipped log of a test run."""
+    # Spread the files over subdirectories to keep the directories small.
+    return os.path.join(settings.LOG_STORE_ROOT,
+                        str(int(test_run_id) // 1000),
+                        '%s.log.gz' % test_run_id)
+
+
+def has_log(test_run_id):
+    return os.path.exists(log_path(test_run_id))
+
+
+def store_log(test_run_id, content):
+    """Store the log (replacing an existing one)."""
+    path = log_path(test_run_id)
+    dir_path = os.path.dirname(path)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    if content is None:
+        content = ''
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    log_file = gzip.open(path + '.tmp', 'wb')
+    try:
+        log_file.write(content)
+    finally:
+        log_file.close()
+    os.rename(path + '.tmp', path)
+    logger.debug("Stored log of test run %s in %s", test_run_id, path)
+
+
+def delete_log(test_run_id):
+    path = log_path(test_run_id)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def compressed_size(test_run_id):
+    return os.path.getsize(log_path(test_run_id))
+
+
+def uncompressed_size(test_run_id):
+    """Return the size of the log, read from the gzip trailer.
+
+    The trailer stores the size modulo 2**32, which is plenty for logs.
+    """
+    with open(log_path(test_run_id), 'rb') as log_file:
+        log_file.seek(-4, os.SEEK_END)
+        return struct.unpack(str('<I'), log_file.read(4))[0]
+
+
+def iter_compressed(test_run_id):
+    """Yield the raw gzipped log in chunks."""
+    with open(log_path(test_run_id), 'rb') as log_file:
+        while True:
+            chunk = log_file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_log(test_run_id, start=0, end=None):
+    """Yield the uncompressed log in chunks, from byte start to end."""
+    log_file = gzip.open(log_path(test_run_id), 'rb')
+    try:
+        if start:
+            log_file.seek(start)
+        position = start
+        while end is None or position <= end:
+            size = CHUNK_SIZE
+            if end is not None:
+                size = min(size, end - position + 1)
+            chunk = log_file.read(size)
+            if not chunk:
+                break
+            position += len(chunk)
+            yield chunk
+    finally:
+        log_file.close()
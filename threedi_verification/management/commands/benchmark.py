@@ -0,0 +1,76 @@
+import logging
+import optparse
+import os
+import sys
+
+from django.core.management.base import BaseCommand
+
+from threedi_verification import benchmark
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = ""
+    help = "Benchmark the checks on synthetic netcdf files."
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            '--size',
+            dest='size',
+            default='small',
+            type='choice',
+            choices=list(benchmark.SIZES),
+            help="Size of the synthetic model: %s" % ', '.join(
+                benchmark.SIZES)),
+        optparse.make_option(
+            '--checks',
+            dest='checks',
+            type='int',
+            default=20,
+            help="Number of checks per kind of check"),
+        optparse.make_option(
+            '--save-baseline',
+            action='store_true',
+            dest='save_baseline',
+            default=False,
+            help="Save the results as the new baseline"),
+        optparse.make_option(
+            '--baseline',
+            dest='baseline',
+            default=None,
+            help="Baseline json file (default: var/benchmarks/"
+            "baseline_<size>.json)"),
+        optparse.make_option(
+            '--tolerance',
+            dest='tolerance',
+            type='float',
+            default=benchmark.DEFAULT_TOLERANCE,
+            help="Percentage a benchmark may get worse"),
+        )
+
+    def handle(self, *args, **options):
+        baseline_path = options['baseline'] or os.path.join(
+            benchmark.BENCHMARK_DIR, 'baseline_%s.json' % options['size'])
+        results = benchmark.run_benchmarks(size=options['size'],
+                                           checks=options['checks'])
+        for name, result in results.items():
+            print("%-28s %s" % (name, ', '.join(
+                '%s=%s' % (key, value) for key, value in result.items())))
+
+        if options['save_baseline']:
+            benchmark.save_baseline(results, baseline_path)
+            logger.info("Saved baseline to %s", baseline_path)
+            return
+        if not os.path.exists(baseline_path):
+            logger.info("No baseline %s to compare with", baseline_path)
+            return
+        lines, regressed = benchmark.compare(
+            results, benchmark.load_baseline(baseline_path),
+            tolerance=options['tolerance'])
+        print("\nCompared with %s:" % baseline_path)
+        for line in lines:
+            print(line)
+        if regressed:
+            logger.error("Benchmarks got more than %s%% worse",
+                         options['tolerance'])
+            sys.exit(1)
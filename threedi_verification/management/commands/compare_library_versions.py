@@ -0,0 +1,48 @@
+import logging
+import optparse
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from threedi_verification import regressions
+from threedi_verification.models import LibraryVersion
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = "old_library_version_id new_library_version_id"
+    help = "Show what changed in the results between two library versions."
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            '--threshold',
+            dest='threshold',
+            type='float',
+            default=regressions.DEFAULT_THRESHOLD,
+            help="Report found values that moved more than this percentage"),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Pass two library version ids")
+        old, new = [LibraryVersion.objects.get(pk=pk) for pk in args]
+        differences = regressions.compare(
+            old.pk, new.pk, threshold=options['threshold'])
+        print("Comparing %s with %s" % (old, new))
+
+        for title, key in [("New crashes", 'new_crashes'),
+                           ("Fixed crashes", 'fixed_crashes')]:
+            print("\n%s: %s" % (title, len(differences[key])))
+            for change in differences[key]:
+                print("  %s" % change.pretty_name)
+
+        for title, key in [("Checks that broke", 'broken_checks'),
+                           ("Checks that were fixed", 'fixed_checks'),
+                           ("Moved values (> %s%%)" % options['threshold'],
+                            'moved_values')]:
+            print("\n%s: %s" % (title, len(differences[key])))
+            for change in differences[key]:
+                print("  %s, %s (%s): %s -> %s (desired: %s)" % (
+                    change.pretty_name, change.instruction_key,
+                    change.parameter, change.old_found, change.new_found,
+                    change.desired))
@@ -0,0 +1,52 @@
+import logging
+import optparse
+
+from django.core.management.base import BaseCommand
+
+from threedi_verification import performance
+from threedi_verification.models import LibraryVersion
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = "[library_version_id]"
+    help = ("Show test cases that got significantly slower or use more "
+            "memory (default: in the latest library versions).")
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            '--history',
+            dest='history',
+            type='int',
+            default=performance.HISTORY,
+            help="Number of previous library versions to compare with"),
+        optparse.make_option(
+            '--threshold',
+            dest='threshold',
+            type='float',
+            default=performance.THRESHOLD,
+            help="Number of noise floors above the median to flag"),
+        )
+
+    def handle(self, *args, **options):
+        if args:
+            library_versions = [LibraryVersion.objects.get(pk=args[0])]
+        else:
+            library_versions = [
+                library_version for library_version in
+                [LibraryVersion.objects.filter(library=library).first()
+                 # order_by(): the default ordering would add last_modified
+                 # to the distinct.
+                 for library in LibraryVersion.objects.order_by().values_list(
+                     'library', flat=True).distinct()]
+                if library_version is not None]
+        for library_version in library_versions:
+            regressions = performance.detect(
+                library_version, history=options['history'],
+                threshold=options['threshold'])
+            print("%s: %s regressions" % (library_version, len(regressions)))
+            for regression in regressions:
+                print("  %s: %s %.1f, median %.1f +/- %.1f (score %.1f)" % (
+                    regression.pretty_name, regression.metric,
+                    regression.value, regression.median, regression.noise,
+                    regression.score))
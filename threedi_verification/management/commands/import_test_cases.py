@@ -2,20 +2,37 @@ from __future__ import absolute_import
 
 import logging
 import os
+import time
 
 from django.core.management.base import BaseCommand
-from django.conf import settings
+from django.db import transaction
 
+from threedi_verification import pagecache
+from threedi_verification import testbank
 from threedi_verification.models import TestCase
+from threedi_verification.models import derived_fields
 from threedi_verification.models import (SUBGRID, FLOW)
 
 logger = logging.getLogger(__name__)
 
-subgrid_testcases_dir = settings.TESTCASES_ROOT
-flow_testcases_dir = settings.URBAN_TESTCASES_ROOT
+# sqlite allows max 999 variables per query, so "id IN (...)" needs chunks.
+CHUNK_SIZE = 500
 
-# the definition of a flow model, i.e., it must contain these dirs
-FLOW_REQUIRED_DIRS = {'input_generated'}
+
+def read_index(dirpath):
+    """Return the contents of index.txt or None if it doesn't exist."""
+    index_file = os.path.join(dirpath, 'index.txt')
+    if os.path.exists(index_file):
+        contents = open(index_file).read()
+        # Decode, otherwise comparing with the info in the db always differs
+        # for non-ascii texts.
+        return contents.decode('utf-8', 'replace')
+
+
+def chunks(items):
+    items = list(items)
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
 
 
 class Command(BaseCommand):
@@ -23,69 +40,100 @@ class Command(BaseCommand):
     help = "Import configuration from testbank directory"
 
     def handle(self, *args, **options):
-        self.look_at_subgrid_test_cases()
-        self.look_at_flow_test_cases()
+        with transaction.atomic():
+            snapshots = [self.look_at_subgrid_test_cases(),
+                         self.look_at_flow_test_cases()]
+        # Only now: a snapshot saved before a rollback would mark the changed
+        # dirs as seen and their index.txt would never be imported.
+        for snapshot in snapshots:
+            snapshot.save()
+        # The bulk queries don't send signals, so invalidate the pages here.
+        pagecache.bump_generation()
 
     def look_at_subgrid_test_cases(self):
         """Import and/or update the (new) subgrid test cases"""
-        existing = TestCase.objects.filter(library=SUBGRID).values_list(
-            'id', flat=True)
-        found = []
-        for dirpath, dirnames, filenames in os.walk(subgrid_testcases_dir):
-            mdu_filenames = [f for f in filenames if f.endswith('.mdu')]
-            for mdu_filename in mdu_filenames:
-                full_path = os.path.join(dirpath, mdu_filename)
-                relative_path = os.path.relpath(full_path,
-                                                subgrid_testcases_dir)
-                if TestCase.objects.filter(path=relative_path).exists():
-                    test_case = TestCase.objects.get(path=relative_path)
-                    test_case.is_active = True
-                    test_case.save()
-                    found.append(test_case.id)
-                    continue
-                test_case = TestCase.objects.create(
-                    path=relative_path, library=SUBGRID)
-                logger.info("Found new testcase: %s", test_case)
-                index_file = os.path.join(dirpath, 'index.txt')
-                if os.path.exists(index_file):
-                    test_case.info = open(index_file).read()
-                    test_case.save()
-                found.append(test_case.id)
-        not_active_anymore = set(existing) - set(found)
-        for id in not_active_anymore:
-            test_case = TestCase.objects.get(id=id)
-            test_case.is_active = False
-            test_case.save()
+        return self.look_at_test_cases(SUBGRID)
 
     def look_at_flow_test_cases(self):
         """Import/update flow test cases"""
-        existing = TestCase.objects.filter(library=FLOW).values_list('id',
-                                                                     flat=True)
-        found = []
-        for dir_path, dirs, files in os.walk(flow_testcases_dir):
-            # if the dir_path has required dirs, assume it is a model dir
-            #has_required_dirs = FLOW_REQUIRED_DIRS.issubset(set(dirs))
-            ini_files = [f for f in files if f.endswith('.ini')]
-            if len(ini_files) == 1: # has_required_dirs and
-                relative_path = os.path.relpath(dir_path, flow_testcases_dir)
-                if TestCase.objects.filter(path=relative_path).exists():
-                    test_case = TestCase.objects.get(path=relative_path)
-                    test_case.is_active = True
-                    test_case.save()
-                    found.append(test_case.id)
-                    continue
-                test_case = TestCase.objects.create(path=relative_path,
-                                                    library=FLOW)
-                logger.info("Found new testcase: %s", test_case)
-                index_file = os.path.join(dir_path, 'index.txt')
-                if os.path.exists(index_file):
-                    test_case.info = open(index_file).read()
-                    test_case.save()
-                found.append(test_case.id)
-
-        # check if existing db models are on disk, make inactive when not
-        not_active_anymore = set(existing) - set(found)
-        for id in not_active_anymore:
-            test_case = TestCase.objects.get(id=id)
-            test_case.is_active = False
-            test_case.save()
+        return self.look_at_test_cases(FLOW)
+
+    def look_at_test_cases(self, library):
+        """Refresh the test bank snapshot and synchronize the test cases.
+
+        Only the model dirs that changed since the previous snapshot have
+        their index.txt read. Return the snapshot, to be saved once the
+        transaction has been committed.
+        """
+        snapshot = testbank.Snapshot(library)
+        changed = snapshot.refresh()
+        root = testbank.testbank_root(library)
+        found = {}
+        for path in snapshot.models():
+            model_dir = testbank.model_dir(library, path)
+            if model_dir in changed:
+                found[path] = read_index(os.path.join(root, model_dir))
+            else:
+                found[path] = None  # Means: leave the info alone.
+        logger.info("Found %s %s test cases, %s changed model dirs",
+                    len(found), library, len(changed))
+        self.synchronize(library, found)
+        return snapshot
+
+    def synchronize(self, library, found):
+        """Make the test cases in the database match the found ones.
+
+        ``found`` is a {path: contents of index.txt} dict, with None if the
+        info needn't be updated. Everything is done with a fixed handful of
+        queries, regardless of the number of test cases.
+        """
+        start_time = time.time()
+        existing = dict(
+            (test_case.path, test_case) for test_case in
+            TestCase.objects.filter(library=library).only(
+                'id', 'path', 'info', 'is_active'))
+        logger.debug("Loaded %s existing test cases in %.2fs",
+                     len(existing), time.time() - start_time)
+
+        start_time = time.time()
+        root = testbank.testbank_root(library)
+        new_test_cases = []
+        for path, info in found.items():
+            if path in existing:
+                continue
+            if info is None:
+                info = read_index(
+                    os.path.join(root, testbank.model_dir(library, path)))
+            new_test_cases.append(
+                TestCase(path=path, library=library, info=info,
+                         **derived_fields(path, library, info)))
+        TestCase.objects.bulk_create(new_test_cases)
+        for test_case in new_test_cases:
+            logger.info("Found new testcase: %s", test_case)
+        logger.debug("Created %s test cases in %.2fs",
+                     len(new_test_cases), time.time() - start_time)
+
+        start_time = time.time()
+        reactivated = [test_case.id for path, test_case in existing.items()
+                       if path in found and not test_case.is_active]
+        for ids in chunks(reactivated):
+            TestCase.objects.filter(id__in=ids).update(is_active=True)
+        changed_info = [(test_case.id, path, found[path])
+                        for path, test_case in existing.items()
+                        if path in found and found[path] is not None
+                        and found[path] != test_case.info]
+        for id, path, info in changed_info:
+            TestCase.objects.filter(id=id).update(
+                info=info, **derived_fields(path, library, info))
+        logger.debug("Reactivated %s and updated info of %s test cases "
+                     "in %.2fs", len(reactivated), len(changed_info),
+                     time.time() - start_time)
+
+        start_time = time.time()
+        not_active_anymore = [
+            test_case.id for path, test_case in existing.items()
+            if path not in found and test_case.is_active]
+        for ids in chunks(not_active_anymore):
+            TestCase.objects.filter(id__in=ids).update(is_active=False)
+        logger.debug("Deactivated %s test cases in %.2fs",
+                     len(not_active_anymore), time.time() - start_time)
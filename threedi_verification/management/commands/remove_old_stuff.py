@@ -1,29 +1,29 @@
-import datetime
 import logging
-import os
+import optparse
 
 from django.core.management.base import BaseCommand
-from django.conf import settings
 
-from threedi_verification.models import TestRun
-LIBRARY_LOCATION = '/opt/3di/bin/subgridf90'
+from threedi_verification import retention
 
 logger = logging.getLogger(__name__)
 
 
 class Command(BaseCommand):
     args = ""
-    help = "Remove test results that are more than a month old."
+    help = "Remove test results and archive pages according to the retention policies."
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            '--dry-run',
+            action='store_true',
+            dest='dry_run',
+            default=False,
+            help="Only report what would be removed"),
+        )
 
     def handle(self, *args, **options):
-        self.remove_old_test_results()
-
-    def remove_old_test_results(self):
-        now = datetime.datetime.now()
-        month_ago = now - datetime.timedelta(days=30)
-        old_test_runs = TestRun.objects.filter(run_started__lt=month_ago)[:500]
-        # Max 500 as zapping all of them takes forever.
-        logger.info("Removing %s old test runs", len(old_test_runs))
-        for old_test_run in old_test_runs:
-            logger.debug("Removing %s", old_test_run)
-            old_test_run.delete()
+        result = retention.apply_retention(dry_run=options['dry_run'])
+        logger.info(
+            "%s %s test runs and %s files/directories, %.1f MB",
+            options['dry_run'] and "Would remove" or "Removed",
+            result['test_runs'], result['files'],
+            result['bytes'] / 1024.0 / 1024.0)
@@ -15,7 +15,10 @@ from threedi_verification.models import TestCaseVersion
 from threedi_verification.models import TestRun
 from threedi_verification.models import FLOW
 
+from threedi_verification import profiling
+from threedi_verification import testbank
 from threedi_verification import verification
+from threedi_verification.writer import ResultWriter
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +35,12 @@ class Command(BaseCommand):
             dest='force',
             default=False,
             help="Force test run"),
+        optparse.make_option(
+            '--profile',
+            action='store_true',
+            dest='profile',
+            default=False,
+            help="Profile the python code, see profiling.py"),
         )
 
     def handle(self, *args, **options):
@@ -41,6 +50,7 @@ class Command(BaseCommand):
         # For FLOW, the path is the model directory
         self.full_path = os.path.abspath(args[0])
 
+        start_time = time.time()
         self.look_at_library()
         self.look_at_test_case()
         if not self.test_case.has_csv:
@@ -49,7 +59,17 @@ class Command(BaseCommand):
         self.set_up_test_run(force=options['force'])
         if self.test_run is None:
             return
+        self.setup_seconds = time.time() - start_time
+        # run_simulations passes a shared writer to batch the db writes.
+        self.writer = options.get('writer') or ResultWriter(batch_size=1)
+        if options.get('profile'):
+            profiler = profiling.start()
         self.run_simulation()
+        if not options.get('writer') or options.get('profile'):
+            # With --profile, the db writes of this run are profiled, too.
+            self.writer.flush()
+        if options.get('profile'):
+            profiling.finish(profiler, self.test_run)
 
     def look_at_library(self):
         """Look at the library and create a new library version, if needed."""
@@ -61,11 +81,9 @@ class Command(BaseCommand):
             library=FLOW, last_modified=last_modified)
         if created:
             logger.info("Found new library version: %s", self.library_version)
-            num_mdu_files = 0
-            for dirpath, dirnames, filenames in os.walk(MODELS_ROOT):
-                num_mdu_files += len(
-                    [f for f in filenames if f.endswith('.mdu')])
-            self.library_version.num_test_cases = num_mdu_files
+            snapshot = testbank.Snapshot(FLOW)
+            snapshot.refresh()
+            self.library_version.num_test_cases = len(snapshot.models())
 
     def look_at_test_case(self):
         """Look at the test case and create a new TestCaseVersion if needed,
@@ -77,28 +95,10 @@ class Command(BaseCommand):
             self.full_path, MODELS_ROOT)
         self.test_case = TestCase.objects.get(path=relative_path)
 
-        # Detects changes in models
-        #THis is not necessary anymore for new folderstructure
-        #timestamps1 = [
-        #    os.path.getmtime(os.path.join(testdir, filename))
-        #    for filename in os.listdir(testdir)]
-
+        # The csv, ini and index.txt files define the version.
+        last_modified = testbank.last_modified(FLOW, testdir)
         csvs = glob.glob(os.path.join(testdir, '*.csv'))
-        csv_timestamps = [
-            os.path.getmtime(filename) for filename in csvs]
-
-        inis = glob.glob(os.path.join(testdir, '*.ini'))
-        ini_timestamps = [
-            os.path.getmtime(filename) for filename in inis]
-
         index_file = os.path.join(testdir, 'index.txt')
-        index_ts = [os.path.getmtime(index_file)] if os.path.isfile(
-            index_file) else []  # note: list with one value
-
-        modification_timestamps = (csv_timestamps + index_ts +
-                                   ini_timestamps)  #timestamps1 +
-        last_modified = datetime.datetime.fromtimestamp(
-            max(modification_timestamps))
 
         # Create new TestCaseVersion if a version with the date isn't found
         tcvs = TestCaseVersion.objects.filter(
@@ -148,8 +148,13 @@ class Command(BaseCommand):
     def run_simulation(self):
         inp_report = verification.InpReport(self.full_path,
                                             test_run_id=self.test_run.id)
+        inp_report.timings.add('setup', self.setup_seconds)
         start_time = time.time()
         verification.run_flow_simulation(self.full_path, inp_report)
         self.test_run.duration = time.time() - start_time
-        self.test_run.report = inp_report.as_dict()
-        self.test_run.save()
+        with inp_report.timings.span('report'):
+            report = inp_report.as_dict()
+        self.test_run.timing = inp_report.timings.as_list()
+        self.test_run.store_rusage(inp_report.rusage)
+        self.writer.add(self.test_run, report,
+                        log=inp_report.log or inp_report.successfully_loaded_log)
@@ -1,3 +1,4 @@
+import datetime
 import logging
 import os
 import optparse
@@ -6,14 +7,45 @@ from django.conf import settings
 from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
+from threedi_verification import testbank
+from threedi_verification.models import LibraryVersion
 from threedi_verification.models import TestCase
+from threedi_verification.models import TestRun
 from threedi_verification.models import (SUBGRID, FLOW)
+from threedi_verification.writer import ResultWriter
 
 logger = logging.getLogger(__name__)
 subgrid_testcases_dir = settings.TESTCASES_ROOT
 flow_testcases_dir = settings.URBAN_TESTCASES_ROOT
 
 
+def completed_test_runs(library, library_location):
+    """Return {(test case id, test case version date)} of completed runs.
+
+    Only for the current library version. A test case whose model directory
+    didn't change since such a run needn't be looked at by the
+    run_*_simulation command at all.
+    """
+    last_modified = datetime.datetime.fromtimestamp(
+        os.path.getmtime(library_location))
+    try:
+        library_version = LibraryVersion.objects.get(
+            library=library, last_modified=last_modified)
+    except LibraryVersion.DoesNotExist:
+        return set()
+    return set(TestRun.objects.filter(
+        library_version=library_version,
+        duration__isnull=False).exclude(duration=0).values_list(
+            'test_case_version__test_case',
+            'test_case_version__last_modified'))
+
+
+def unchanged_test_case(test_case, snapshot, completed):
+    model_dir = testbank.model_dir(test_case.library, test_case.path)
+    last_modified = snapshot.last_modified(model_dir)
+    return (test_case.id, last_modified) in completed
+
+
 class Command(BaseCommand):
     args = ""
     help = "Run the subgrid simulations"
@@ -42,6 +74,12 @@ class Command(BaseCommand):
             dest='only_flow',
             default=False,
             help="Run flow simulations"),
+        optparse.make_option(
+            '--profile',
+            action='store_true',
+            dest='profile',
+            default=False,
+            help="Profile every test run, see profiling.py"),
         )
 
     def handle(self, *args, **options):
@@ -59,8 +97,19 @@ class Command(BaseCommand):
         original_dir = os.getcwd()
         logger.info("Original starting dir: %s", original_dir)
 
+        writer = ResultWriter()
+        try:
+            self.run_all(options, run_all, original_dir, writer)
+        finally:
+            writer.flush()
+
+    def run_all(self, options, run_all, original_dir, writer):
         if options['only_flow'] or run_all:
             print("Starting flow simulations.")
+            snapshot = testbank.Snapshot(FLOW)
+            snapshot.refresh()
+            completed = completed_test_runs(
+                FLOW, settings.FLOW_LIBRARY_LOCATION)
             for test_case in TestCase.objects.filter(library=FLOW):
                 full_path = os.path.join(flow_testcases_dir, test_case.path)
                 if not os.path.exists(full_path):
@@ -68,14 +117,23 @@ class Command(BaseCommand):
                     continue
                 if options['limit'] and (options['limit'] not in full_path):
                     continue
+                if not options['force'] and unchanged_test_case(
+                        test_case, snapshot, completed):
+                    logger.debug("%s is unchanged, skipping", test_case)
+                    continue
                 call_command('run_flow_simulation', full_path,
-                             force=options['force'])
+                             force=options['force'], writer=writer,
+                             profile=options['profile'])
 
         logger.debug("Current dir after running flow simulations: %s", os.getcwd())
         os.chdir(original_dir)
 
         if options['only_subgrid'] or run_all:
             print("Starting subgrid simulations.")
+            snapshot = testbank.Snapshot(SUBGRID)
+            snapshot.refresh()
+            completed = completed_test_runs(
+                SUBGRID, settings.SUBGRID_LIBRARY_LOCATION)
             for test_case in TestCase.objects.filter(library=SUBGRID):
                 full_path = os.path.join(subgrid_testcases_dir, test_case.path)
                 if not os.path.exists(full_path):
@@ -83,5 +141,10 @@ class Command(BaseCommand):
                     continue
                 if options['limit'] and (options['limit'] not in full_path):
                     continue
+                if not options['force'] and unchanged_test_case(
+                        test_case, snapshot, completed):
+                    logger.debug("%s is unchanged, skipping", test_case)
+                    continue
                 call_command('run_subgrid_simulation', full_path,
-                             force=options['force'])
+                             force=options['force'], writer=writer,
+                             profile=options['profile'])
@@ -13,7 +13,10 @@ from threedi_verification.models import LibraryVersion
 from threedi_verification.models import TestCase
 from threedi_verification.models import TestCaseVersion
 from threedi_verification.models import TestRun
+from threedi_verification import profiling
+from threedi_verification import testbank
 from threedi_verification import verification
+from threedi_verification.writer import ResultWriter
 from threedi_verification.models import SUBGRID
 
 
@@ -30,6 +33,12 @@ class Command(BaseCommand):
             dest='force',
             default=False,
             help="Force test run"),
+        optparse.make_option(
+            '--profile',
+            action='store_true',
+            dest='profile',
+            default=False,
+            help="Profile the python code, see profiling.py"),
         )
 
     def handle(self, *args, **options):
@@ -38,6 +47,7 @@ class Command(BaseCommand):
             sys.exit(1)
         self.full_path = os.path.abspath(args[0])
 
+        start_time = time.time()
         self.look_at_library()
         self.look_at_test_case()
         if not self.test_case.has_csv:
@@ -46,7 +56,17 @@ class Command(BaseCommand):
         self.set_up_test_run(force=options['force'])
         if self.test_run is None:
             return
+        self.setup_seconds = time.time() - start_time
+        # run_simulations passes a shared writer to batch the db writes.
+        self.writer = options.get('writer') or ResultWriter(batch_size=1)
+        if options.get('profile'):
+            profiler = profiling.start()
         self.run_simulation()
+        if not options.get('writer') or options.get('profile'):
+            # With --profile, the db writes of this run are profiled, too.
+            self.writer.flush()
+        if options.get('profile'):
+            profiling.finish(profiler, self.test_run)
 
     def look_at_library(self):
         """Look at the library and create a new library version, if needed"""
@@ -58,12 +78,9 @@ class Command(BaseCommand):
             library=SUBGRID, last_modified=last_modified)
         if created:
             logger.info("Found new library version: %s", self.library_version)
-            num_mdu_files = 0
-            for dirpath, dirnames, filenames in os.walk(
-                    settings.TESTCASES_ROOT):
-                num_mdu_files += len(
-                    [f for f in filenames if f.endswith('.mdu')])
-            self.library_version.num_test_cases = num_mdu_files
+            snapshot = testbank.Snapshot(SUBGRID)
+            snapshot.refresh()
+            self.library_version.num_test_cases = len(snapshot.models())
 
     def look_at_test_case(self):
         """Look at the test case and create a new TestCaseVersion, if needed"""
@@ -72,13 +89,7 @@ class Command(BaseCommand):
                                         settings.TESTCASES_ROOT)
         self.test_case = TestCase.objects.get(path=relative_path)
 
-        modification_timestamp = max([
-            os.path.getmtime(os.path.join(testdir, filename))
-            for filename in os.listdir(testdir)
-            if not (filename.endswith('.dia') or
-                    filename.startswith('fort.'))])
-        last_modified = datetime.datetime.fromtimestamp(
-            modification_timestamp)
+        last_modified = testbank.last_modified(SUBGRID, testdir)
 
         if not TestCaseVersion.objects.filter(
                 test_case=self.test_case,
@@ -126,9 +137,15 @@ class Command(BaseCommand):
             library_version=self.library_version)
 
     def run_simulation(self):
-        mdu_report = verification.MduReport(self.full_path)
+        mdu_report = verification.MduReport(self.full_path,
+                                            test_run_id=self.test_run.id)
+        mdu_report.timings.add('setup', self.setup_seconds)
         start_time = time.time()
         verification.run_subgrid_simulation(self.full_path, mdu_report)
         self.test_run.duration = (time.time() - start_time)
-        self.test_run.report = mdu_report.as_dict()
-        self.test_run.save()
+        with mdu_report.timings.span('report'):
+            report = mdu_report.as_dict()
+        self.test_run.timing = mdu_report.timings.as_list()
+        self.test_run.store_rusage(mdu_report.rusage)
+        self.writer.add(self.test_run, report,
+                        log=mdu_report.log or mdu_report.successfully_loaded_log)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.conf import settings
+from django.db import models
+
+
+# Frozen copies of the logstore functions as they were when this migration
+# was written.
+def log_path(test_run_id):
+    return os.path.join(settings.LOG_STORE_ROOT,
+                        str(int(test_run_id) // 1000),
+                        '%s.log.gz' % test_run_id)
+
+
+def store_log(test_run_id, content):
+    path = log_path(test_run_id)
+    dir_path = os.path.dirname(path)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    log_file = gzip.open(path + '.tmp', 'wb')
+    try:
+        log_file.write(content)
+    finally:
+        log_file.close()
+    os.rename(path + '.tmp', path)
+
+
+def read_log(test_run_id):
+    log_file = gzip.open(log_path(test_run_id), 'rb')
+    try:
+        return log_file.read().decode('utf-8')
+    finally:
+        log_file.close()
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Move the full logs out of the reports into the log store."
+        for test_run in orm.TestRun.objects.all().iterator():
+            log = (test_run.report.get('log') or
+                   test_run.report.get('successfully_loaded_log'))
+            if not log:
+                continue
+            store_log(test_run.pk, log)
+            if test_run.report.get('log'):
+                test_run.report['log'] = test_run.report.get('log_summary')
+            test_run.report['successfully_loaded_log'] = None
+            test_run.save()
+
+    def backwards(self, orm):
+        "Put the full logs back into the reports."
+        for test_run in orm.TestRun.objects.all().iterator():
+            if not os.path.exists(log_path(test_run.pk)):
+                continue
+            log = read_log(test_run.pk)
+            if test_run.report.get('log'):
+                test_run.report['log'] = log
+            else:
+                test_run.report['successfully_loaded_log'] = log
+            test_run.save()
+
+    models = {
+        u'threedi_verification.libraryversion': {
+            'Meta': {'ordering': "[u'-last_modified']", 'object_name': 'LibraryVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {'unique': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+            'num_test_cases': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'threedi_verification.testcase': {
+            'Meta': {'ordering': "[u'path']", 'object_name': 'TestCase'},
+            'path': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'has_csv': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+        },
+        u'threedi_verification.testcaseversion': {
+            'Meta': {'ordering': "[u'test_case', u'last_modified']", 'object_name': 'TestCaseVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_case_versions'", 'to': u"orm['threedi_verification.TestCase']"})
+        },
+        u'threedi_verification.testrun': {
+            'Meta': {'ordering': "[u'-run_started']", 'object_name': 'TestRun'},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'report': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'run_started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'test_case_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.TestCaseVersion']"})
+        }
+    }
+
+    complete_apps = ['threedi_verification']
+    symmetrical = True
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'TestRun.status'
+        db.add_column(u'threedi_verification_testrun', 'status',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=32, db_index=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'TestRun.has_crashed'
+        db.add_column(u'threedi_verification_testrun', 'has_crashed',
+                      self.gf('django.db.models.fields.BooleanField')(default=False, db_index=True),
+                      keep_default=False)
+
+        # Adding field 'TestRun.num_right'
+        db.add_column(u'threedi_verification_testrun', 'num_right',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'TestRun.num_wrong'
+        db.add_column(u'threedi_verification_testrun', 'num_wrong',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'TestRun.num_errored'
+        db.add_column(u'threedi_verification_testrun', 'num_errored',
+                      self.gf('django.db.models.fields.IntegerField')(default=0),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'TestRun.status'
+        db.delete_column(u'threedi_verification_testrun', 'status')
+
+        # Deleting field 'TestRun.has_crashed'
+        db.delete_column(u'threedi_verification_testrun', 'has_crashed')
+
+        # Deleting field 'TestRun.num_right'
+        db.delete_column(u'threedi_verification_testrun', 'num_right')
+
+        # Deleting field 'TestRun.num_wrong'
+        db.delete_column(u'threedi_verification_testrun', 'num_wrong')
+
+        # Deleting field 'TestRun.num_errored'
+        db.delete_column(u'threedi_verification_testrun', 'num_errored')
+
+
+    models = {
+        u'threedi_verification.libraryversion': {
+            'Meta': {'ordering': "[u'-last_modified']", 'object_name': 'LibraryVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {'unique': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+            'num_test_cases': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'threedi_verification.testcase': {
+            'Meta': {'ordering': "[u'path']", 'object_name': 'TestCase'},
+            'path': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'has_csv': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+        },
+        u'threedi_verification.testcaseversion': {
+            'Meta': {'ordering': "[u'test_case', u'last_modified']", 'object_name': 'TestCaseVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_case_versions'", 'to': u"orm['threedi_verification.TestCase']"})
+        },
+        u'threedi_verification.testrun': {
+            'Meta': {'ordering': "[u'-run_started']", 'object_name': 'TestRun'},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'report': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'run_started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'blank': 'True'}),
+            'has_crashed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'num_right': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_wrong': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_errored': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'test_case_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.TestCaseVersion']"})
+        }
+    }
+
+    complete_apps = ['threedi_verification']
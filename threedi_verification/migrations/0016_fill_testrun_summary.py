@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import gzip
+import os
+
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.conf import settings
+from django.db import models
+
+# Frozen copies of verification's statuses, of the log store's log_path()
+# and of models.report_summary() as they were when this migration was
+# written.
+CRASHED = 'Calculation core crashes'
+SOME_ERROR = 'Model loading problems'
+LOADED = 'Loaded fine'
+
+
+def log_path(test_run_id):
+    return os.path.join(settings.LOG_STORE_ROOT,
+                        str(int(test_run_id) // 1000),
+                        '%s.log.gz' % test_run_id)
+
+
+def full_log(test_run_id, report):
+    """Return the full log: 0014 moved it to the log store."""
+    log = report.get('log') or ''
+    if log and os.path.exists(log_path(test_run_id)):
+        log_file = gzip.open(log_path(test_run_id), 'rb')
+        try:
+            log = log_file.read().decode('utf-8', 'replace')
+        finally:
+            log_file.close()
+    return log
+
+
+def report_status(test_run_id, report):
+    """Return the status; older reports don't have it, derive it then."""
+    if report.get('status'):
+        return report['status']
+    if not report:
+        return ''  # The run never finished.
+    # The report only has the tail of the log, the segfault message can be
+    # above the backtrace.
+    log = full_log(test_run_id, report)
+    if 'Segmentation fault' in log:
+        return CRASHED
+    if log or not report.get('loadable', True):
+        return SOME_ERROR
+    return LOADED
+
+
+def report_summary(test_run_id, report):
+    report = report or {}
+    instruction_reports = report.get('instruction_reports', [])
+    return dict(
+        status=report_status(test_run_id, report),
+        has_crashed=bool(report.get('log')),
+        num_right=len([ir for ir in instruction_reports if ir['equal']]),
+        num_wrong=len([ir for ir in instruction_reports if not ir['equal']]),
+        num_errored=len([ir for ir in instruction_reports
+                         if not ir['equal'] and ir.get('log')]),
+    )
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Fill the summary fields of the existing test runs."
+        for test_run in orm.TestRun.objects.all().iterator():
+            summary = report_summary(test_run.pk, test_run.report)
+            orm.TestRun.objects.filter(pk=test_run.pk).update(**summary)
+
+    def backwards(self, orm):
+        "Nothing to do: the fields are removed by the previous migration."
+
+    models = {
+        u'threedi_verification.libraryversion': {
+            'Meta': {'ordering': "[u'-last_modified']", 'object_name': 'LibraryVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {'unique': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+            'num_test_cases': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'threedi_verification.testcase': {
+            'Meta': {'ordering': "[u'path']", 'object_name': 'TestCase'},
+            'path': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'has_csv': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+        },
+        u'threedi_verification.testcaseversion': {
+            'Meta': {'ordering': "[u'test_case', u'last_modified']", 'object_name': 'TestCaseVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_case_versions'", 'to': u"orm['threedi_verification.TestCase']"})
+        },
+        u'threedi_verification.testrun': {
+            'Meta': {'ordering': "[u'-run_started']", 'object_name': 'TestRun'},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'report': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'run_started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'blank': 'True'}),
+            'has_crashed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'num_right': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_wrong': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_errored': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'test_case_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.TestCaseVersion']"})
+        }
+    }
+
+    complete_apps = ['threedi_verification']
+    symmetrical = True
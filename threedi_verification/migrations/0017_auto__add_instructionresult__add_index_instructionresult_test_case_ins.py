@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'InstructionResult'
+        db.create_table(u'threedi_verification_instructionresult', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('test_run', self.gf('django.db.models.fields.related.ForeignKey')(related_name=u'instruction_results', to=orm['threedi_verification.TestRun'])),
+            ('test_case', self.gf('django.db.models.fields.related.ForeignKey')(related_name=u'instruction_results', to=orm['threedi_verification.TestCase'])),
+            ('library_version', self.gf('django.db.models.fields.related.ForeignKey')(related_name=u'instruction_results', to=orm['threedi_verification.LibraryVersion'])),
+            ('instruction_key', self.gf('django.db.models.fields.CharField')(max_length=255)),
+            ('parameter', self.gf('django.db.models.fields.CharField')(max_length=64, blank=True)),
+            ('desired', self.gf('django.db.models.fields.FloatField')(null=True, blank=True)),
+            ('found', self.gf('django.db.models.fields.FloatField')(null=True, blank=True)),
+            ('epsilon', self.gf('django.db.models.fields.FloatField')(null=True, blank=True)),
+            ('equal', self.gf('django.db.models.fields.BooleanField')(default=False)),
+        ))
+        db.send_create_signal(u'threedi_verification', ['InstructionResult'])
+
+        # Adding index on 'InstructionResult', fields ['test_case', 'instruction_key', 'library_version']
+        db.create_index(u'threedi_verification_instructionresult', ['test_case_id', 'instruction_key', 'library_version_id'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'InstructionResult', fields ['test_case', 'instruction_key', 'library_version']
+        db.delete_index(u'threedi_verification_instructionresult', ['test_case_id', 'instruction_key', 'library_version_id'])
+
+        # Deleting model 'InstructionResult'
+        db.delete_table(u'threedi_verification_instructionresult')
+
+
+    models = {
+        u'threedi_verification.instructionresult': {
+            'Meta': {'object_name': 'InstructionResult', 'index_together': "[(u'test_case', u'instruction_key', u'library_version')]"},
+            'desired': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'epsilon': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'equal': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'found': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'instruction_key': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'instruction_results'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'parameter': ('django.db.models.fields.CharField', [], {'max_length': '64', 'blank': 'True'}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'instruction_results'", 'to': u"orm['threedi_verification.TestCase']"}),
+            'test_run': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'instruction_results'", 'to': u"orm['threedi_verification.TestRun']"})
+        },
+        u'threedi_verification.libraryversion': {
+            'Meta': {'ordering': "[u'-last_modified']", 'object_name': 'LibraryVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {'unique': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+            'num_test_cases': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'threedi_verification.testcase': {
+            'Meta': {'ordering': "[u'path']", 'object_name': 'TestCase'},
+            'path': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'has_csv': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+        },
+        u'threedi_verification.testcaseversion': {
+            'Meta': {'ordering': "[u'test_case', u'last_modified']", 'object_name': 'TestCaseVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_case_versions'", 'to': u"orm['threedi_verification.TestCase']"})
+        },
+        u'threedi_verification.testrun': {
+            'Meta': {'ordering': "[u'-run_started']", 'object_name': 'TestRun'},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'report': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'run_started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'blank': 'True'}),
+            'has_crashed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'num_right': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_wrong': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_errored': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'test_case_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.TestCaseVersion']"})
+        }
+    }
+
+    complete_apps = ['threedi_verification']
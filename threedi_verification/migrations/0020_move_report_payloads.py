@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+# Frozen copy of models.PAYLOAD_KEYS as it was when this migration was
+# written.
+PAYLOAD_KEYS = (
+    'csv_contents',
+    'input_files',
+    'model_parameters',
+    'successfully_loaded_log',
+)
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Move the bulky parts of the existing reports to the payloads."
+        for test_run in orm.TestRun.objects.all().iterator():
+            payload = dict((key, test_run.report.pop(key))
+                           for key in PAYLOAD_KEYS if key in test_run.report)
+            orm.TestRunPayload.objects.create(test_run=test_run,
+                                              report=payload)
+            orm.TestRun.objects.filter(pk=test_run.pk).update(
+                report=test_run.report)
+
+    def backwards(self, orm):
+        "Put the payloads back into the reports."
+        for payload in orm.TestRunPayload.objects.all().iterator():
+            test_run = orm.TestRun.objects.get(pk=payload.test_run_id)
+            test_run.report.update(payload.report)
+            orm.TestRun.objects.filter(pk=test_run.pk).update(
+                report=test_run.report)
+        orm.TestRunPayload.objects.all().delete()
+
+    models = {
+        u'threedi_verification.instructionresult': {
+            'Meta': {'object_name': 'InstructionResult', 'index_together': "[(u'test_case', u'instruction_key', u'library_version')]"},
+            'desired': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'epsilon': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'equal': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'found': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'instruction_key': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'instruction_results'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'parameter': ('django.db.models.fields.CharField', [], {'max_length': '64', 'blank': 'True'}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'instruction_results'", 'to': u"orm['threedi_verification.TestCase']"}),
+            'test_run': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'instruction_results'", 'to': u"orm['threedi_verification.TestRun']"})
+        },
+        u'threedi_verification.libraryversion': {
+            'Meta': {'ordering': "[u'-last_modified']", 'object_name': 'LibraryVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {'unique': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+            'num_test_cases': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        u'threedi_verification.testcase': {
+            'Meta': {'ordering': "[u'path']", 'object_name': 'TestCase'},
+            'path': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '255'}),
+            'has_csv': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'info': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'library': ('django.db.models.fields.CharField', [], {'default': "u'SUBG'", 'max_length': '4'}),
+        },
+        u'threedi_verification.testcaseversion': {
+            'Meta': {'ordering': "[u'test_case', u'last_modified']", 'object_name': 'TestCaseVersion'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_modified': ('django.db.models.fields.DateTimeField', [], {}),
+            'test_case': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_case_versions'", 'to': u"orm['threedi_verification.TestCase']"})
+        },
+        u'threedi_verification.testrun': {
+            'Meta': {'ordering': "[u'-run_started']", 'object_name': 'TestRun'},
+            'duration': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'library_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.LibraryVersion']"}),
+            'report': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'run_started': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '32', 'blank': 'True'}),
+            'has_crashed': ('django.db.models.fields.BooleanField', [], {'default': 'False', 'db_index': 'True'}),
+            'num_right': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_wrong': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'num_errored': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'test_case_version': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'test_runs'", 'to': u"orm['threedi_verification.TestCaseVersion']"})
+        },
+        u'threedi_verification.testrunpayload': {
+            'Meta': {'object_name': 'TestRunPayload'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'report': ('jsonfield.fields.JSONField', [], {'default': '{}'}),
+            'test_run': ('django.db.models.fields.related.OneToOneField', [], {'related_name': "u'payload'", 'unique': 'True', 'to': u"orm['threedi_verification.TestRun']"})
+        }
+    }
+
+    complete_apps = ['threedi_verification']
+    symmetrical = True
@@ -3,13 +3,22 @@
 from __future__ import print_function, unicode_literals
 from __future__ import absolute_import, division
 import logging
+import math
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models import Count
+from django.db.models import Sum
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 import jsonfield
 
+from threedi_verification import pagecache
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +31,35 @@ LIBRARIES = (
 )
 
 
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Set up sqlite for several processes writing at the same time."""
+    if connection.vendor != 'sqlite':
+        return
+    cursor = connection.cursor()
+    for pragma in getattr(settings, 'SQLITE_PRAGMAS', []):
+        cursor.execute(pragma)
+
+
+# Keys of the report that are stored in the TestRunPayload.
+PAYLOAD_KEYS = (
+    'csv_contents',
+    'input_files',
+    'model_parameters',
+    'successfully_loaded_log',
+)
+
+RUSAGE_FIELDS = (
+    'max_rss',
+    'user_time',
+    'system_time',
+    'block_input',
+    'block_output',
+    'voluntary_switches',
+    'involuntary_switches',
+)
+
+
 class TestCase(models.Model):
 
     path = models.CharField(
@@ -44,6 +82,27 @@ class TestCase(models.Model):
     is_active = models.BooleanField(
         default=True,
         verbose_name=_("is active: directory still exists"))
+    # Parsed from the path and info by save() (or derived_fields() for bulk
+    # updates), so that lists can sort and group on them in the database.
+    category = models.CharField(
+        max_length=255,
+        blank=True,
+        db_index=True,
+        verbose_name=_("category"))
+    pretty_name = models.CharField(
+        max_length=255,
+        blank=True,
+        db_index=True,
+        verbose_name=_("display name"))
+    # Maintained by TestRun.save(), so that the test cases page doesn't need
+    # a query per test case.
+    latest_run = models.ForeignKey(
+        'TestRun',
+        blank=True,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        verbose_name=_("latest test run"))
 
     class Meta:
         verbose_name = _("test case")
@@ -57,38 +116,27 @@ class TestCase(models.Model):
         return reverse('threedi_verification.test_case',
                        kwargs={'pk': self.pk})
 
-    @cached_property
-    def pretty_name(self):
-        name = self.path.split('/')[-1]
-        if self.library == SUBGRID:
-            name = name.rstrip('.mdu')
-        if self.info:
-            first_line = self.info.split('\n')[0].strip()
-            return "%s (%s)" % (first_line, name)
-        else:
-            return name
+    def save(self, *args, **kwargs):
+        for field, value in derived_fields(
+                self.path, self.library, self.info).items():
+            setattr(self, field, value)
+        super(TestCase, self).save(*args, **kwargs)
 
     @cached_property
     def latest_test_run(self):
-        test_runs = TestRun.objects.filter(
-            test_case_version__test_case=self)
-        if test_runs.exists():
-            return test_runs.first()
+        return self.latest_run
 
     @cached_property
     def library_name(self):
         return dict(LIBRARIES).get(self.library)
 
-    @cached_property
-    def category(self):
-        """Custom parsing of the category from index.txt"""
-        key = "category:"
-        if self.info is None or key not in self.info:
-            return "Unknown category"
-        else:
-            f = filter(lambda s: s.startswith(key), self.info.split('\n'))[0]
-            t = f[len(key):].strip()
-            return t
+    def instruction_history(self, instruction_key, limit=50):
+        """Return the results of one check for the latest library versions."""
+        return InstructionResult.objects.filter(
+            test_case=self,
+            instruction_key=instruction_key).select_related(
+                'library_version').order_by(
+                    '-library_version__last_modified')[:limit]
 
 
 class TestCaseVersion(models.Model):
@@ -127,6 +175,9 @@ class LibraryVersion(models.Model):
     num_test_cases = models.IntegerField(
         default=0,
         verbose_name=_("number of test cases when library was first found"))
+    is_tagged = models.BooleanField(
+        default=False,
+        verbose_name=_("is tagged: keep all its test runs"))
 
     class Meta:
         verbose_name = _("library version")
@@ -148,15 +199,25 @@ class LibraryVersion(models.Model):
         was first found actually been run? Perhaps a newer version was found
         halfway the tests, if so, this library version can mostly be omitted.
         """
-        return self.test_runs.all().count() >= self.num_test_cases
+        # The versions page annotates num_test_runs to save a query.
+        num_test_runs = getattr(self, 'num_test_runs', None)
+        if num_test_runs is None:
+            num_test_runs = self.test_runs.all().count()
+        return num_test_runs >= self.num_test_cases
+
+    @cached_property
+    def run_counts(self):
+        """Return the number of crashed runs and wrong/right checks.
+
+        For a list of library versions, set this with ``run_counts()`` in
+        one query instead.
+        """
+        return run_counts([self.id])[self.id]
 
     @cached_property
     def num_crashes(self):
         """Return range for use in a for loop to display 'x' icons."""
-        # This one probably needs caching.
-        return range(len([test_run for test_run in self.test_runs.filter(
-            test_case_version__test_case__has_csv=True)
-            if test_run.has_crashed]))
+        return range(self.run_counts['crashes'])
 
     @cached_property
     def library_name(self):
@@ -182,6 +243,70 @@ class TestRun(models.Model):
         verbose_name=_("duration"))
     report = jsonfield.JSONField()
 
+    # Summary of the report, filled in by save() so that lists of test runs
+    # don't need to parse the report.
+    status = models.CharField(
+        max_length=32,
+        blank=True,
+        db_index=True,
+        verbose_name=_("status"))
+    has_crashed = models.BooleanField(
+        default=False,
+        db_index=True,
+        verbose_name=_("has crashed"))
+    num_right = models.IntegerField(
+        default=0,
+        verbose_name=_("number of right results"))
+    num_wrong = models.IntegerField(
+        default=0,
+        verbose_name=_("number of wrong results (including errors)"))
+    num_errored = models.IntegerField(
+        default=0,
+        verbose_name=_("number of results with setup errors"))
+    # [{'name': ..., 'seconds': ..., 'count': ...}] per phase of the run,
+    # see verification.Timings.
+    timing = jsonfield.JSONField(
+        blank=True,
+        null=True,
+        verbose_name=_("timing per phase"))
+
+    # Resource usage of the simulator (and its child processes), see
+    # utils.rusage_dict().
+    max_rss = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("peak memory (MB)"))
+    user_time = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("user cpu time (seconds)"))
+    system_time = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("system cpu time (seconds)"))
+    block_input = models.IntegerField(
+        blank=True,
+        null=True,
+        verbose_name=_("block input operations"))
+    block_output = models.IntegerField(
+        blank=True,
+        null=True,
+        verbose_name=_("block output operations"))
+    voluntary_switches = models.IntegerField(
+        blank=True,
+        null=True,
+        verbose_name=_("voluntary context switches"))
+    involuntary_switches = models.IntegerField(
+        blank=True,
+        null=True,
+        verbose_name=_("involuntary context switches"))
+    # Top functions of the harness' own python code when run with --profile,
+    # see profiling.summary().
+    profile = jsonfield.JSONField(
+        blank=True,
+        null=True,
+        verbose_name=_("profile summary"))
+
     class Meta:
         verbose_name = _("test run")
         verbose_name_plural = _("test runs")
@@ -194,34 +319,246 @@ class TestRun(models.Model):
         return reverse('threedi_verification.test_run',
                        kwargs={'pk': self.pk})
 
-    @cached_property
-    def has_crashed(self):
-        return bool(self.report.get('log'))
-
-    @cached_property
-    def num_wrong(self):
-        if 'instruction_reports' not in self.report:
-            return 0
-        return len(
-            [ir for ir in self.report['instruction_reports']
-             if not ir['equal']])
-
-    @cached_property
-    def num_right(self):
-        if 'instruction_reports' not in self.report:
-            return 0
-        return len(
-            [ir for ir in self.report['instruction_reports']
-             if ir['equal']])
+    def save(self, *args, **kwargs):
+        is_new = self.pk is None
+        self.update_summary()
+        super(TestRun, self).save(*args, **kwargs)
+        if is_new:
+            TestCase.objects.filter(
+                pk=self.test_case_version.test_case_id).update(
+                    latest_run=self)
+
+    def update_summary(self):
+        """Fill the summary fields from the report."""
+        summary = report_summary(self.report)
+        self.status = summary['status']
+        self.has_crashed = summary['has_crashed']
+        self.num_right = summary['num_right']
+        self.num_wrong = summary['num_wrong']
+        self.num_errored = summary['num_errored']
+
+    def store_report(self, report):
+        """Save the report, with the bulky parts in a separate payload."""
+        self.report = dict((key, value) for key, value in report.items()
+                           if key not in PAYLOAD_KEYS)
+        self.save()
+        payload, created = TestRunPayload.objects.get_or_create(
+            test_run=self)
+        payload.report = dict((key, value) for key, value in report.items()
+                              if key in PAYLOAD_KEYS)
+        payload.save()
+        self.store_instruction_results()
 
     @cached_property
+    def full_report(self):
+        """Return the report including the payload (one extra query)."""
+        report = dict(self.report)
+        try:
+            report.update(self.payload.report)
+        except TestRunPayload.DoesNotExist:
+            pass
+        return report
+
+    def store_instruction_results(self):
+        """Write one InstructionResult per check in the report."""
+        self.instruction_results.all().delete()
+        test_case_id = self.test_case_version.test_case_id
+        InstructionResult.objects.bulk_create([
+            InstructionResult(
+                test_run=self,
+                test_case_id=test_case_id,
+                library_version_id=self.library_version_id,
+                **instruction_result_fields(instruction_report))
+            for instruction_report in self.report.get(
+                'instruction_reports', [])])
+
+    def store_rusage(self, rusage):
+        """Set the resource usage fields from a utils.rusage_dict()."""
+        for field in RUSAGE_FIELDS:
+            setattr(self, field, rusage.get(field))
+
+    @property
+    def cpu_time(self):
+        if self.user_time is None:
+            return
+        return self.user_time + (self.system_time or 0)
+
+    @property
     def progress_bar_percentage_right(self):
         if self.num_wrong + self.num_right == 0:  # Division by zero.
             return 0
         return int(100 * self.num_right / (self.num_wrong + self.num_right))
 
-    @cached_property
+    @property
     def progress_bar_percentage_wrong(self):
         if self.num_wrong + self.num_right == 0:  # Division by zero.
             return 0
         return int(100 * self.num_wrong / (self.num_wrong + self.num_right))
+
+
+class TestRunPayload(models.Model):
+    """The bulky parts of a test run's report.
+
+    Only the test run page needs them; the lists of test runs shouldn't have
+    to load them.
+    """
+    test_run = models.OneToOneField(
+        TestRun,
+        verbose_name=_("test run"),
+        related_name='payload')
+    report = jsonfield.JSONField()
+
+    class Meta:
+        verbose_name = _("test run payload")
+        verbose_name_plural = _("test run payloads")
+
+    def __unicode__(self):
+        return _("payload of test run %s") % self.test_run_id
+
+
+class InstructionResult(models.Model):
+    """Result of one check of a test run.
+
+    The same results are in the test run's report, but this way the history
+    of one check can be queried without loading all the reports.
+    """
+    test_run = models.ForeignKey(
+        TestRun,
+        verbose_name=_("test run"),
+        related_name='instruction_results')
+    # test_case and library_version are also available via the test_run,
+    # they're here for the index.
+    test_case = models.ForeignKey(
+        TestCase,
+        verbose_name=_("test case"),
+        related_name='instruction_results')
+    library_version = models.ForeignKey(
+        LibraryVersion,
+        verbose_name=_("library version"),
+        related_name='instruction_results')
+    instruction_key = models.CharField(
+        max_length=255,
+        verbose_name=_("instruction key"),
+        help_text=_("csv file name without extension and row number"))
+    parameter = models.CharField(
+        max_length=64,
+        blank=True,
+        verbose_name=_("parameter"))
+    desired = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("desired value"))
+    found = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("found value"))
+    epsilon = models.FloatField(
+        blank=True,
+        null=True,
+        verbose_name=_("allowed margin"))
+    equal = models.BooleanField(
+        default=False,
+        verbose_name=_("found value is equal to the desired value"))
+
+    class Meta:
+        verbose_name = _("instruction result")
+        verbose_name_plural = _("instruction results")
+        index_together = [('test_case', 'instruction_key', 'library_version')]
+
+    def __unicode__(self):
+        return _("result of %s") % self.instruction_key
+
+
+def derived_fields(path, library, info):
+    """Return the category and pretty_name of a test case.
+
+    The category is the ``category:`` line of index.txt, the pretty name is
+    the first line of index.txt plus the model name.
+    """
+    name = path.split('/')[-1]
+    if library == SUBGRID:
+        name = name.rstrip('.mdu')
+    if info:
+        first_line = info.split('\n')[0].strip()
+        pretty_name = "%s (%s)" % (first_line, name)
+    else:
+        pretty_name = name
+
+    key = "category:"
+    category = "Unknown category"
+    for line in (info or '').split('\n'):
+        if line.startswith(key):
+            category = line[len(key):].strip()
+            break
+    return dict(category=category[:255], pretty_name=pretty_name[:255])
+
+
+def _float_or_none(value):
+    """Return value as float; None for strings like 'nan' and NaN itself."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value):
+        return None
+    return value
+
+
+def instruction_result_fields(instruction_report):
+    """Return InstructionResult fields for an instruction report dict."""
+    return dict(
+        instruction_key=instruction_report.get('instruction_id') or '',
+        parameter=instruction_report.get('parameter') or '',
+        desired=_float_or_none(instruction_report.get('desired')),
+        found=_float_or_none(instruction_report.get('found')),
+        epsilon=_float_or_none(instruction_report.get('epsilon')),
+        equal=bool(instruction_report.get('equal')),
+    )
+
+
+def report_summary(report):
+    """Return the summary fields of a TestRun for a report."""
+    report = report or {}
+    instruction_reports = report.get('instruction_reports', [])
+    return dict(
+        status=report.get('status') or '',
+        has_crashed=bool(report.get('log')),
+        num_right=len([ir for ir in instruction_reports if ir['equal']]),
+        num_wrong=len([ir for ir in instruction_reports if not ir['equal']]),
+        num_errored=len([ir for ir in instruction_reports
+                         if not ir['equal'] and ir.get('log')]),
+    )
+
+
+def run_counts(library_version_ids):
+    """Return {id: {'crashes': x, 'wrong': y, 'right': z}} with one query.
+
+    Only test cases with csv files (so: with checks) are counted.
+    """
+    result = dict((id, {'crashes': 0, 'wrong': 0, 'right': 0})
+                  for id in library_version_ids)
+    rows = TestRun.objects.filter(
+        library_version__in=library_version_ids,
+        test_case_version__test_case__has_csv=True).values(
+            'library_version', 'has_crashed').annotate(
+                num_runs=Count('id'),
+                num_wrong=Sum('num_wrong'),
+                num_right=Sum('num_right')).order_by()
+    for row in rows:
+        counts = result[row['library_version']]
+        if row['has_crashed']:
+            counts['crashes'] += row['num_runs']
+        counts['wrong'] += row['num_wrong'] or 0
+        counts['right'] += row['num_right'] or 0
+    return result
+
+
+@receiver(post_save, sender=TestRun)
+@receiver(post_delete, sender=TestRun)
+@receiver(post_save, sender=TestCase)
+@receiver(post_delete, sender=TestCase)
+@receiver(post_save, sender=LibraryVersion)
+@receiver(post_delete, sender=LibraryVersion)
+def invalidate_pages(sender, **kwargs):
+    """The cached overview pages are outdated now."""
+    pagecache.bump_generation()
@@ -0,0 +1,74 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Caching of the rendered overview pages.
+
+The pages only change when a test run, test case or library version is
+saved, so the cache keys include a generation counter that is bumped
+whenever that happens (see the signal receivers in models.py). Old pages
+are simply never asked for again and expire. The simulations run in other
+processes than the website, so the cache has to be a shared one, like the
+file based cache.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import datetime
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'threedi_verification.generation'
+
+
+def state():
+    """Return the generation and the time (utc datetime) it started."""
+    value = cache.get(GENERATION_KEY)
+    if value is None:
+        # Cache was cleared (or is new): start a new generation.
+        value = (int(time.time()), time.time())
+        cache.set(GENERATION_KEY, value, None)
+    generation, timestamp = value
+    return generation, datetime.datetime.utcfromtimestamp(timestamp)
+
+
+def bump_generation():
+    """Mark all cached pages as outdated."""
+    generation, last_modified = state()
+    cache.set(GENERATION_KEY, (generation + 1, time.time()), None)
+
+
+def _path_hash(path):
+    return hashlib.md5(path.encode('utf-8')).hexdigest()
+
+
+def etag(path):
+    generation, last_modified = state()
+    return '%s-%s' % (generation, _path_hash(path))
+
+
+def last_modified():
+    generation, last_modified = state()
+    return last_modified
+
+
+def page_key(path):
+    generation, last_modified = state()
+    return 'threedi_verification.page.%s.%s' % (generation, _path_hash(path))
+
+
+def get_page(key):
+    return cache.get(key)
+
+
+def set_page(key, content):
+    """Store a page under the key that was determined before rendering.
+
+    If the data changed while rendering, the key is of the previous
+    generation, so the page is never served.
+    """
+    cache.set(key, content, settings.PAGE_CACHE_TIMEOUT)
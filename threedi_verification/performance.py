@@ -0,0 +1,114 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Detection of test cases that got slower or use more memory.
+
+A test run of a library version is compared with the runs of the *same*
+test case version in the previous library versions, so changes to the model
+itself don't count. Robust statistics are used: the median of the history
+and a noise floor based on the median absolute deviation (MAD), with a
+minimum relative and absolute noise so that very stable histories don't
+flag every tiny difference.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+from collections import defaultdict
+from collections import namedtuple
+import logging
+
+from threedi_verification.models import LibraryVersion
+from threedi_verification.models import TestRun
+
+logger = logging.getLogger(__name__)
+
+HISTORY = 10  # Number of previous library versions to look at.
+MIN_HISTORY = 3  # Runs needed before we say anything.
+THRESHOLD = 3.0  # Number of noise floors a value must be above the median.
+MAD_TO_SIGMA = 1.4826  # MAD * this estimates the standard deviation.
+# {metric: (minimum relative noise, minimum absolute noise)}
+METRICS = {
+    'duration': (0.05, 0.5),  # seconds
+    'max_rss': (0.05, 5.0),  # MB
+}
+
+Regression = namedtuple(
+    'Regression',
+    ['test_case_id', 'pretty_name', 'metric', 'median', 'noise', 'value',
+     'test_run_id', 'score'])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def noise_floor(metric, values):
+    """Return the noise of the values: scaled MAD, with a minimum."""
+    center = median(values)
+    mad = median([abs(value - center) for value in values])
+    min_relative, min_absolute = METRICS[metric]
+    return max(MAD_TO_SIGMA * mad, min_relative * abs(center), min_absolute)
+
+
+def is_regression(metric, history, value, threshold=THRESHOLD):
+    """Return (flagged, median, noise, score) for a new value."""
+    center = median(history)
+    noise = noise_floor(metric, history)
+    score = (value - center) / noise
+    return score > threshold, center, noise, score
+
+
+def detect(library_version, history=HISTORY, threshold=THRESHOLD):
+    """Return the Regressions of a library version, worst first.
+
+    Two queries: one for the previous library versions and one for the
+    completed, non-crashed runs of all of them.
+    """
+    previous_ids = list(LibraryVersion.objects.filter(
+        library=library_version.library,
+        last_modified__lt=library_version.last_modified).order_by(
+            '-last_modified').values_list('id', flat=True)[:history])
+    rows = TestRun.objects.filter(
+        library_version__in=previous_ids + [library_version.id],
+        has_crashed=False,
+        duration__gt=0).order_by().values_list(
+            'id', 'library_version', 'test_case_version',
+            'test_case_version__test_case',
+            'test_case_version__test_case__pretty_name',
+            'duration', 'max_rss')
+
+    # {test case version: {metric: [values]}} of the previous versions.
+    histories = defaultdict(lambda: defaultdict(list))
+    new_runs = []
+    for (test_run_id, library_version_id, test_case_version_id,
+         test_case_id, pretty_name, duration, max_rss) in rows:
+        values = {'duration': duration, 'max_rss': max_rss}
+        if library_version_id == library_version.id:
+            new_runs.append((test_run_id, test_case_version_id,
+                             test_case_id, pretty_name, values))
+            continue
+        for metric, value in values.items():
+            if value is not None:
+                histories[test_case_version_id][metric].append(value)
+
+    regressions = []
+    for (test_run_id, test_case_version_id, test_case_id, pretty_name,
+         values) in new_runs:
+        for metric in sorted(METRICS):
+            history_values = histories[test_case_version_id][metric]
+            value = values[metric]
+            if value is None or len(history_values) < MIN_HISTORY:
+                continue
+            flagged, center, noise, score = is_regression(
+                metric, history_values, value, threshold=threshold)
+            if flagged:
+                regressions.append(Regression(
+                    test_case_id, pretty_name, metric, center, noise, value,
+                    test_run_id, score))
+    regressions.sort(key=lambda regression: -regression.score)
+    logger.debug("Found %s performance regressions in %s",
+                 len(regressions), library_version)
+    return regressions
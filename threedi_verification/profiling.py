@@ -0,0 +1,74 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Profiling of our own python code for one test run (``--profile``).
+
+The simulator runs in a separate process and isn't profiled: this is about
+the checks, plotting, report serialisation and database writes around it.
+The full profile is written to ``var/profiles/<test run id>.prof`` (open it
+with ``python -m pstats`` or snakeviz), the top functions are stored in
+``TestRun.profile``.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import cProfile
+import logging
+import os
+import pstats
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.path.join(settings.BUILDOUT_DIR, 'var', 'profiles')
+TOP_FUNCTIONS = 25
+
+
+def start():
+    """Return a running profiler."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def profile_path(test_run_id):
+    return os.path.join(PROFILE_DIR, '%s.prof' % test_run_id)
+
+
+def function_name(function):
+    """Return 'path:line(name)' with the path shortened where possible."""
+    filename, line, name = function
+    if filename.startswith(settings.BUILDOUT_DIR):
+        filename = os.path.relpath(filename, settings.BUILDOUT_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.split('site-packages' + os.sep)[-1]
+    if filename == '~':  # Built-in.
+        return name
+    return '%s:%s(%s)' % (filename, line, name)
+
+
+def summary(stats, limit=TOP_FUNCTIONS):
+    """Return the functions with the most own time, as a list of dicts."""
+    rows = []
+    for function, (primitive_calls, calls, own_time, cumulative_time,
+                   callers) in stats.stats.items():
+        rows.append(dict(function=function_name(function),
+                         calls=calls,
+                         own_time=round(own_time, 4),
+                         cumulative_time=round(cumulative_time, 4)))
+    rows.sort(key=lambda row: -row['own_time'])
+    return rows[:limit]
+
+
+def finish(profiler, test_run):
+    """Stop the profiler, write the .prof and store the summary."""
+    profiler.disable()
+    if not os.path.exists(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    path = profile_path(test_run.id)
+    profiler.dump_stats(path)
+    stats = pstats.Stats(profiler)
+    test_run.profile = dict(total_time=round(stats.total_tt, 4),
+                            functions=summary(stats))
+    test_run.save(update_fields=['profile'])
+    logger.info("Wrote profile of test run %s to %s", test_run.id, path)
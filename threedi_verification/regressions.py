@@ -0,0 +1,128 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Differences between the results of two library versions.
+
+Everything is done with a few joins in the database on the summary columns
+of TestRun and on InstructionResult, no report is loaded. Per test case only
+the latest test run of a library version is compared.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+from collections import namedtuple
+import logging
+
+from django.db import connection
+
+from threedi_verification.models import InstructionResult
+from threedi_verification.models import TestCase
+from threedi_verification.models import TestCaseVersion
+from threedi_verification.models import TestRun
+
+logger = logging.getLogger(__name__)
+
+# Percentage with which a found value must move to be reported.
+DEFAULT_THRESHOLD = 5.0
+
+CrashChange = namedtuple(
+    'CrashChange',
+    ['test_case_id', 'pretty_name', 'old_test_run_id', 'new_test_run_id'])
+CheckChange = namedtuple(
+    'CheckChange',
+    ['test_case_id', 'pretty_name', 'instruction_key', 'parameter',
+     'old_test_run_id', 'new_test_run_id', 'old_found', 'new_found',
+     'desired'])
+
+
+def _tables():
+    return dict(
+        test_run=TestRun._meta.db_table,
+        test_case_version=TestCaseVersion._meta.db_table,
+        test_case=TestCase._meta.db_table,
+        instruction_result=InstructionResult._meta.db_table)
+
+
+LATEST_RUNS = """
+    SELECT MAX(run.id)
+    FROM {test_run} run
+    JOIN {test_case_version} version ON run.test_case_version_id = version.id
+    WHERE run.library_version_id = %s
+    GROUP BY version.test_case_id
+"""
+
+CRASH_CHANGES = """
+    SELECT case_.id, case_.pretty_name, old.id, new.id
+    FROM {test_run} old
+    JOIN {test_case_version} old_version
+        ON old.test_case_version_id = old_version.id
+    JOIN {test_case_version} new_version
+        ON new_version.test_case_id = old_version.test_case_id
+    JOIN {test_run} new ON new.test_case_version_id = new_version.id
+    JOIN {test_case} case_ ON case_.id = old_version.test_case_id
+    WHERE old.id IN ({latest_runs})
+    AND new.id IN ({latest_runs})
+    AND old.has_crashed = %s
+    AND new.has_crashed = %s
+    ORDER BY case_.pretty_name
+"""
+
+CHECK_CHANGES = """
+    SELECT case_.id, case_.pretty_name, old.instruction_key, old.parameter,
+        old.test_run_id, new.test_run_id, old.found, new.found, new.desired
+    FROM {instruction_result} old
+    JOIN {instruction_result} new
+        ON new.test_case_id = old.test_case_id
+        AND new.instruction_key = old.instruction_key
+    JOIN {test_case} case_ ON case_.id = old.test_case_id
+    WHERE old.test_run_id IN ({latest_runs})
+    AND new.test_run_id IN ({latest_runs})
+    AND {condition}
+    ORDER BY case_.pretty_name, old.instruction_key
+"""
+
+
+def _query(sql, condition, params):
+    tables = _tables()
+    latest_runs = LATEST_RUNS.format(**tables)
+    sql = sql.format(latest_runs=latest_runs, condition=condition, **tables)
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def crash_changes(old_id, new_id, crashed):
+    """Return test cases that (if crashed) newly crash or (if not) recovered.
+    """
+    rows = _query(CRASH_CHANGES, '',
+                  [old_id, new_id, not crashed, crashed])
+    return [CrashChange(*row) for row in rows]
+
+
+def equality_changes(old_id, new_id, equal):
+    """Return checks that flipped to equal (if equal) or to not equal."""
+    rows = _query(CHECK_CHANGES, 'old.equal = %s AND new.equal = %s',
+                  [old_id, new_id, not equal, equal])
+    return [CheckChange(*row) for row in rows]
+
+
+def moved_values(old_id, new_id, threshold=DEFAULT_THRESHOLD):
+    """Return checks whose found value moved more than threshold percent.
+
+    A found value of zero that changes at all counts as moved.
+    """
+    rows = _query(
+        CHECK_CHANGES,
+        'old.found IS NOT NULL AND new.found IS NOT NULL AND '
+        'ABS(new.found - old.found) > ABS(old.found) * %s',
+        [old_id, new_id, threshold / 100.0])
+    return [CheckChange(*row) for row in rows]
+
+
+def compare(old_id, new_id, threshold=DEFAULT_THRESHOLD):
+    """Return a dict with all differences between two library versions."""
+    return dict(
+        new_crashes=crash_changes(old_id, new_id, crashed=True),
+        fixed_crashes=crash_changes(old_id, new_id, crashed=False),
+        broken_checks=equality_changes(old_id, new_id, equal=False),
+        fixed_checks=equality_changes(old_id, new_id, equal=True),
+        moved_values=moved_values(old_id, new_id, threshold=threshold))
@@ -0,0 +1,215 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Removal of old test runs, their files and old archive pages.
+
+Which test runs are kept is configured in the settings:
+
+- ``RETENTION_MAX_AGE_DAYS``: test runs older than this are removed...
+
+- ``RETENTION_KEEP_LAST``: ...except for the latest N runs per test case...
+
+- ``RETENTION_FAILING_MAX_AGE_DAYS``: ...and failing runs (crashed or with
+  wrong results), which are kept this long...
+
+- ...and all runs of tagged library versions (``LibraryVersion.is_tagged``).
+
+- ``RETENTION_ARCHIVE_MAX_AGE_DAYS``: html archive directories (or their
+  compacted ``.tar.gz``) older than this are removed, including their
+  entries in the archive manifest.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import datetime
+import logging
+import os
+import shutil
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from threedi_verification import logstore
+from threedi_verification import pagecache
+from threedi_verification import profiling
+from threedi_verification import verification
+from threedi_verification.models import FLOW
+from threedi_verification.models import InstructionResult
+from threedi_verification.models import TestRun
+from threedi_verification.models import TestRunPayload
+from threedi_verification.models import invalidate_pages
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+def plot_dir(test_run_id, library, test_case_path):
+    """Return the MEDIA_ROOT directory with the plots of a test run.
+
+    This mirrors verification.plot_it(), which uses the model directory it
+    runs in.
+    """
+    if library == FLOW:
+        model_dir = os.path.join(settings.URBAN_TESTCASES_ROOT,
+                                 test_case_path)
+    else:
+        model_dir = os.path.dirname(
+            os.path.join(settings.TESTCASES_ROOT, test_case_path))
+    model_relpath = os.path.relpath(model_dir, settings.BUILDOUT_DIR)
+    return os.path.join(settings.MEDIA_ROOT, model_relpath, str(test_run_id))
+
+
+def size_of(path):
+    """Return the number of bytes of a file or directory (tree)."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            if not os.path.islink(full_path):
+                total += os.path.getsize(full_path)
+    return total
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def test_runs_to_remove(now=None):
+    """Return the ids of the test runs that no policy wants to keep."""
+    if now is None:
+        now = datetime.datetime.now()
+    too_old = now - datetime.timedelta(days=settings.RETENTION_MAX_AGE_DAYS)
+    failing_too_old = now - datetime.timedelta(
+        days=settings.RETENTION_FAILING_MAX_AGE_DAYS)
+
+    # One pass over a few small columns of all test runs, newest first per
+    # test case, to find the latest N per test case.
+    rows = TestRun.objects.order_by(
+        'test_case_version__test_case', '-run_started').values_list(
+            'id', 'test_case_version__test_case', 'run_started',
+            'has_crashed', 'num_wrong', 'library_version__is_tagged')
+    to_remove = []
+    current_test_case = None
+    seen = 0
+    for (id, test_case_id, run_started, has_crashed, num_wrong,
+         is_tagged) in rows.iterator():
+        if test_case_id != current_test_case:
+            current_test_case = test_case_id
+            seen = 0
+        seen += 1
+        if seen <= settings.RETENTION_KEEP_LAST:
+            continue
+        if is_tagged or run_started >= too_old:
+            continue
+        if (has_crashed or num_wrong) and run_started >= failing_too_old:
+            continue
+        to_remove.append(id)
+    return to_remove
+
+
+def files_of_test_runs(test_run_ids):
+    """Return the plot directories, log files and profiles of the runs."""
+    rows = TestRun.objects.filter(id__in=test_run_ids).values_list(
+        'id', 'test_case_version__test_case__library',
+        'test_case_version__test_case__path')
+    paths = []
+    for id, library, test_case_path in rows:
+        paths.append(plot_dir(id, library, test_case_path))
+        paths.append(logstore.log_path(id))
+        paths.append(profiling.profile_path(id))
+    return [path for path in paths if os.path.lexists(path)]
+
+
+def old_archive_entries(now=None):
+    """Return (index, path) of the archive dirs/tarballs that are too old."""
+    if now is None:
+        now = datetime.datetime.now()
+    too_old = now - datetime.timedelta(
+        days=settings.RETENTION_ARCHIVE_MAX_AGE_DAYS)
+    result = []
+    if not os.path.exists(verification.ARCHIVEDIR):
+        return result
+    for index, entry in enumerate(verification.read_archive_manifest()):
+        name = entry['name']
+        try:
+            created = datetime.datetime.strptime(name, '%Y-%m-%d_%H%M')
+        except ValueError:
+            continue
+        if created > too_old:
+            continue
+        for path in [os.path.join(verification.ARCHIVEDIR, name),
+                     os.path.join(verification.ARCHIVEDIR, name + '.tar.gz')]:
+            if os.path.lexists(path):
+                result.append((index, path))
+    return result
+
+
+def apply_retention(dry_run=False, now=None):
+    """Remove whatever the retention policies don't keep.
+
+    Returns a dict with the number of test runs, the number of files and
+    directories and the number of bytes that are (or would be) reclaimed.
+    """
+    test_run_ids = test_runs_to_remove(now=now)
+    archive_entries = old_archive_entries(now=now)
+    result = {'test_runs': len(test_run_ids),
+              'files': 0,
+              'bytes': 0}
+    logger.info("%s test runs to remove%s", len(test_run_ids),
+                dry_run and " (dry run)" or "")
+
+    if not dry_run:
+        # Otherwise the page cache generation is bumped once per test run.
+        post_delete.disconnect(invalidate_pages, sender=TestRun)
+    try:
+        remove_test_runs(test_run_ids, result, dry_run=dry_run)
+    finally:
+        if not dry_run:
+            post_delete.connect(invalidate_pages, sender=TestRun)
+    if test_run_ids and not dry_run:
+        pagecache.bump_generation()
+
+    result['files'] += len(archive_entries)
+    result['bytes'] += sum(size_of(path) for index, path in archive_entries)
+    if archive_entries and not dry_run:
+        for index, path in archive_entries:
+            logger.debug("Removing old archive %s", path)
+            remove_path(path)
+        removed = set(index for index, path in archive_entries)
+        entries = [entry for index, entry
+                   in enumerate(verification.read_archive_manifest())
+                   if index not in removed]
+        verification.write_archive_manifest(entries)
+        verification.write_archive_pages(entries)
+    return result
+
+
+def remove_test_runs(test_run_ids, result, dry_run=False):
+    """Remove the test runs and their files in chunks; update the result.
+    """
+    for start in range(0, len(test_run_ids), CHUNK_SIZE):
+        chunk = test_run_ids[start:start + CHUNK_SIZE]
+        paths = files_of_test_runs(chunk)
+        result['files'] += len(paths)
+        result['bytes'] += sum(size_of(path) for path in paths)
+        if dry_run:
+            continue
+        # The payloads and instruction results have no signal receivers and
+        # nothing that points at them, so deleting them first takes one
+        # DELETE statement each. Django still fetches the test runs
+        # themselves, because TestCase.latest_run points at them (SET_NULL),
+        # and sends a post_delete signal per run. The page cache receiver is
+        # disconnected meanwhile.
+        with transaction.atomic():
+            InstructionResult.objects.filter(test_run__in=chunk).delete()
+            TestRunPayload.objects.filter(test_run__in=chunk).delete()
+            TestRun.objects.filter(id__in=chunk).delete()
+        for path in paths:
+            remove_path(path)
+        logger.debug("Removed %s test runs", len(chunk))
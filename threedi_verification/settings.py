@@ -18,6 +18,11 @@ STATIC_URL = '/testresults/static/'
 MEDIA_ROOT = os.path.join(BUILDOUT_DIR, 'var', 'media')
 MEDIA_URL = '/testresults/media/'
 
+# Gzipped simulator logs, see logstore.py
+LOG_STORE_ROOT = os.path.join(BUILDOUT_DIR, 'var', 'logs')
+# Snapshots of the test bank directories, see testbank.py.
+TESTBANK_SNAPSHOT_DIR = os.path.join(BUILDOUT_DIR, 'var', 'cache')
+
 ROOT_URLCONF = 'threedi_verification.urls'
 
 SECRET_KEY = 'sleutel van het secreet'
@@ -26,8 +31,35 @@ ALLOWED_HOSTS = ['jenkins.3di.lizard.net', 'localhost']
 TEMPLATE_DEBUG = True
 DATABASES = {
     'default': {'ENGINE': 'django.db.backends.sqlite3',
-                'NAME': os.path.join(BUILDOUT_DIR, 'var/db/verification.db')},
+                'NAME': os.path.join(BUILDOUT_DIR, 'var/db/verification.db'),
+                # Seconds to wait for a lock held by another process.
+                'OPTIONS': {'timeout': 30}},
+}
+# Executed on every new sqlite connection, see models.configure_sqlite().
+# WAL lets readers (the website) continue while a simulation writes.
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=30000',
+]
+# Retention policies for remove_old_stuff, see retention.py
+RETENTION_MAX_AGE_DAYS = 30
+RETENTION_KEEP_LAST = 3
+RETENTION_FAILING_MAX_AGE_DAYS = 90
+RETENTION_ARCHIVE_MAX_AGE_DAYS = 365
+# Number of finished test runs that run_simulations writes per transaction.
+RESULT_BATCH_SIZE = 20
+# ...or after the first of them has waited this many seconds.
+RESULT_BATCH_SECONDS = 300
+# The simulations run in separate processes, so the page cache must be
+# shared between processes, see pagecache.py.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BUILDOUT_DIR, 'var', 'cache', 'pages'),
+    }
 }
+PAGE_CACHE_TIMEOUT = 24 * 60 * 60
 INSTALLED_APPS = [
     'threedi_verification',
     'south',
@@ -123,6 +155,14 @@ INTERNAL_IPS = ['localhost', '127.0.0.1']
 # Libraries (probably) only checked for timestamp
 SUBGRID_LIBRARY_LOCATION = '/opt/3di/bin/subgridf90'
 FLOW_LIBRARY_LOCATION = '/opt/threedicore/lib/libflow.la'
+# Simulator commands, the model file is appended. They run inside the model
+# directory, so a relative path as the first word is taken relative to the
+# buildout dir; use absolute paths after a prefix like 'timeout 5m ' (to kill
+# hanging simulations). For load testing the harness without the libraries,
+# use 'bin/fake_simulator' (see fake_simulator.py) and point the library
+# locations above at any existing file.
+SUBGRID_SIMULATOR = os.path.join(BUILDOUT_DIR, 'bin', 'simplesubgrid')
+FLOW_SIMULATOR = os.path.join(BUILDOUT_DIR, 'bin', 'pyflow')
 
 
 try:
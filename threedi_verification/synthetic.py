@@ -0,0 +1,251 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Synthetic simulator results for benchmarking the checks.
+
+Writes ``subgrid_map.nc`` and ``subgrid_his.nc`` files with the variables
+the checks in verification.py use, for a grid of configurable size, plus
+csv files with instructions for them. The values are a simple function of
+the time step and location, so the desired values in the csvs are known
+and all checks should pass.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+from collections import OrderedDict
+import csv
+import logging
+import math
+import os
+import random
+
+from netCDF4 import Dataset
+from netCDF4 import stringtochar
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CELL_SIZE = 10.0  # meters
+TIME_STEP = 60.0  # seconds
+NAME_LENGTH = 40
+CELL_PARAMETER = 's1'
+LINK_PARAMETER = 'unorm'
+STATION_PARAMETER = 'waterlevel'
+CROSS_SECTION_PARAMETER = 'cross_section_discharge'
+MARGIN = '0.01%'  # Relative, the sums are done in a different order.
+
+MAP_CSVS = ('map_xy.csv', 'map_nflowelem.csv', 'map_nflowlink.csv')
+HIS_CSVS = ('his_stations.csv', 'his_cross_sections.csv')
+
+SIZES = OrderedDict([
+    ('small', dict(cells=1000, links=2000, stations=10, cross_sections=5,
+                   timesteps=100)),
+    ('medium', dict(cells=50000, links=100000, stations=100,
+                    cross_sections=50, timesteps=500)),
+    ('large', dict(cells=500000, links=1000000, stations=1000,
+                   cross_sections=500, timesteps=1000)),
+])
+
+
+def cell_values(time_index, cells):
+    return 1.0 + 0.5 * np.sin(0.001 * cells) + 0.01 * time_index
+
+
+def link_values(time_index, links):
+    return np.cos(0.002 * links) * (1.0 + 0.005 * time_index)
+
+
+def station_values(time_index, stations):
+    return 2.0 + 0.1 * np.sin(stations) + 0.001 * time_index
+
+
+def cross_section_values(time_index, cross_sections):
+    return 0.5 * np.cos(cross_sections) + 0.01 * time_index
+
+
+def times(timesteps):
+    return np.arange(timesteps) * TIME_STEP
+
+
+def grid(cells):
+    """Return the contour x and y arrays, (cells, 4), of a square grid."""
+    columns = int(math.ceil(math.sqrt(cells)))
+    indices = np.arange(cells)
+    x0 = (indices % columns) * CELL_SIZE
+    y0 = (indices // columns) * CELL_SIZE
+    offsets_x = np.array([0, CELL_SIZE, CELL_SIZE, 0])
+    offsets_y = np.array([0, 0, CELL_SIZE, CELL_SIZE])
+    return (x0[:, np.newaxis] + offsets_x,
+            y0[:, np.newaxis] + offsets_y)
+
+
+def names(prefix, number):
+    return ['%s_%s' % (prefix, index) for index in range(number)]
+
+
+def _write_names(dataset, variable_name, dimension, values):
+    variable = dataset.createVariable(variable_name, 'S1',
+                                      (dimension, 'name_len'))
+    variable[:] = stringtochar(np.array(values, dtype='S%s' % NAME_LENGTH))
+
+
+def write_map_netcdf(path, cells, links, timesteps):
+    """Write a subgrid_map.nc, one time step at a time to limit memory."""
+    with Dataset(path, 'w') as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('nFlowElem', cells)
+        dataset.createDimension('nFlowElemContourPts', 4)
+        dataset.createDimension('nFlowLink', links)
+        dataset.createVariable('time', 'f8', ('time',))[:] = times(timesteps)
+        contour_x, contour_y = grid(cells)
+        dataset.createVariable(
+            'FlowElemContour_x', 'f8',
+            ('nFlowElem', 'nFlowElemContourPts'))[:] = contour_x
+        dataset.createVariable(
+            'FlowElemContour_y', 'f8',
+            ('nFlowElem', 'nFlowElemContourPts'))[:] = contour_y
+        dataset.createVariable(
+            'FlowElem_xcc', 'f8', ('nFlowElem',))[:] = contour_x.mean(1)
+        dataset.createVariable(
+            'FlowElem_ycc', 'f8', ('nFlowElem',))[:] = contour_y.mean(1)
+        cell_variable = dataset.createVariable(
+            CELL_PARAMETER, 'f8', ('time', 'nFlowElem'))
+        link_variable = dataset.createVariable(
+            LINK_PARAMETER, 'f8', ('time', 'nFlowLink'))
+        all_cells = np.arange(cells)
+        all_links = np.arange(links)
+        for time_index in range(timesteps):
+            cell_variable[time_index, :] = cell_values(time_index, all_cells)
+            link_variable[time_index, :] = link_values(time_index, all_links)
+
+
+def write_his_netcdf(path, stations, cross_sections, timesteps):
+    with Dataset(path, 'w') as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('stations', stations)
+        dataset.createDimension('cross_section', cross_sections)
+        dataset.createDimension('name_len', NAME_LENGTH)
+        dataset.createVariable('time', 'f8', ('time',))[:] = times(timesteps)
+        _write_names(dataset, 'station_name', 'stations',
+                     names('station', stations))
+        _write_names(dataset, 'cross_section_name', 'cross_section',
+                     names('cross_section', cross_sections))
+        time_indices = np.arange(timesteps)[:, np.newaxis]
+        dataset.createVariable(
+            STATION_PARAMETER, 'f8', ('time', 'stations'))[:] = (
+                station_values(time_indices, np.arange(stations)))
+        dataset.createVariable(
+            CROSS_SECTION_PARAMETER, 'f8', ('time', 'cross_section'))[:] = (
+                cross_section_values(time_indices,
+                                     np.arange(cross_sections)))
+
+
+def _write_csv(path, fieldnames, rows):
+    with open(path, 'wb') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames, delimiter=b';')
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+
+
+def _time_and_ref(values_function, location, timesteps, rng, sum_every):
+    """Return a (time, desired value) instruction part, sometimes a SUM."""
+    if sum_every and rng.randint(0, sum_every - 1) == 0:
+        ref = values_function(np.arange(timesteps), location).sum()
+        return 'SUM', ref
+    time_index = rng.randint(0, timesteps - 1)
+    return repr(time_index * TIME_STEP), values_function(time_index, location)
+
+
+def write_csvs(model_dir, cells, links, stations, cross_sections, timesteps,
+               checks=20, sum_every=5, seed=42):
+    """Write csvs with ``checks`` instructions per kind of check.
+
+    Every ``sum_every``-th (on average) instruction uses a SUM over time or
+    over all cells, which takes the aggregated code paths.
+    """
+    rng = random.Random(seed)
+    contour_x, contour_y = grid(cells)
+    centers_x = contour_x.mean(1)
+    centers_y = contour_y.mean(1)
+
+    rows = []
+    for number in range(checks):
+        cell = rng.randint(0, cells - 1)
+        time, ref = _time_and_ref(cell_values, cell, timesteps, rng,
+                                  sum_every)
+        rows.append(dict(note='Cell %s at x/y' % cell, param=CELL_PARAMETER,
+                         ref=repr(float(ref)), margin=MARGIN, time=time,
+                         x=repr(centers_x[cell]), y=repr(centers_y[cell])))
+    _write_csv(os.path.join(model_dir, 'map_xy.csv'),
+               ['note', 'param', 'ref', 'margin', 'time', 'x', 'y'], rows)
+
+    rows = []
+    for number in range(checks):
+        if sum_every and rng.randint(0, sum_every - 1) == 0:
+            time_index = rng.randint(0, timesteps - 1)
+            rows.append(dict(
+                note='Sum of all cells', param=CELL_PARAMETER,
+                ref=repr(float(cell_values(time_index,
+                                           np.arange(cells)).sum())),
+                margin=MARGIN, time=repr(time_index * TIME_STEP),
+                nFlowElem='SUM'))
+            continue
+        cell = rng.randint(0, cells - 1)
+        time, ref = _time_and_ref(cell_values, cell, timesteps, rng,
+                                  sum_every)
+        rows.append(dict(note='Cell %s' % cell, param=CELL_PARAMETER,
+                         ref=repr(float(ref)), margin=MARGIN, time=time,
+                         nFlowElem=str(cell)))
+    _write_csv(os.path.join(model_dir, 'map_nflowelem.csv'),
+               ['note', 'param', 'ref', 'margin', 'time', 'nFlowElem'], rows)
+
+    rows = []
+    for number in range(checks):
+        link = rng.randint(0, links - 1)
+        time, ref = _time_and_ref(link_values, link, timesteps, rng,
+                                  sum_every)
+        rows.append(dict(note='Link %s' % link, param=LINK_PARAMETER,
+                         ref=repr(float(ref)), margin=MARGIN, time=time,
+                         nFlowLink=str(link)))
+    _write_csv(os.path.join(model_dir, 'map_nflowlink.csv'),
+               ['note', 'param', 'ref', 'margin', 'time', 'nFlowLink'], rows)
+
+    rows = []
+    station_names = names('station', stations)
+    for number in range(checks):
+        station = rng.randint(0, stations - 1)
+        time, ref = _time_and_ref(station_values, station, timesteps, rng,
+                                  sum_every)
+        rows.append(dict(note='Station %s' % station,
+                         param=STATION_PARAMETER, ref=repr(float(ref)),
+                         margin=MARGIN, time=time,
+                         obs_name=station_names[station]))
+    _write_csv(os.path.join(model_dir, 'his_stations.csv'),
+               ['note', 'param', 'ref', 'margin', 'time', 'obs_name'], rows)
+
+    rows = []
+    cross_section_names = names('cross_section', cross_sections)
+    for number in range(checks):
+        cross_section = rng.randint(0, cross_sections - 1)
+        time, ref = _time_and_ref(cross_section_values, cross_section,
+                                  timesteps, rng, sum_every)
+        rows.append(dict(note='Cross section %s' % cross_section,
+                         param=CROSS_SECTION_PARAMETER, ref=repr(float(ref)),
+                         margin=MARGIN, time=time,
+                         cross_section_name=cross_section_names[
+                             cross_section]))
+    _write_csv(os.path.join(model_dir, 'his_cross_sections.csv'),
+               ['note', 'param', 'ref', 'margin', 'time',
+                'cross_section_name'], rows)
+
+
+def write_results(result_dir, cells, links, stations, cross_sections,
+                  timesteps):
+    """Write both netcdfs like the simulator would."""
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+    write_map_netcdf(os.path.join(result_dir, 'subgrid_map.nc'),
+                     cells, links, timesteps)
+    write_his_netcdf(os.path.join(result_dir, 'subgrid_his.nc'),
+                     stations, cross_sections, timesteps)
+    logger.debug("Wrote synthetic results to %s", result_dir)
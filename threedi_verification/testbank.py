@@ -0,0 +1,232 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Persisted snapshot of the test bank directories.
+
+Walking the complete test bank (and stat'ing every file) several times per
+batch gets slow with thousands of models. The snapshot remembers the
+directories, the model files in them and the sizes/mtimes of the files that
+define a test case version. ``refresh()`` only lists directories whose
+mtime changed and only stats the relevant files of the model directories,
+so a batch in which nothing changed is quick.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import datetime
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+
+from threedi_verification.models import FLOW
+
+try:
+    from os import scandir  # Python 3.5+
+except ImportError:
+    try:
+        from scandir import scandir  # Backport
+    except ImportError:
+        scandir = None
+
+logger = logging.getLogger(__name__)
+
+
+def testbank_root(library):
+    if library == FLOW:
+        return settings.URBAN_TESTCASES_ROOT
+    return settings.TESTCASES_ROOT
+
+
+def model_dir(library, test_case_path):
+    """Return the model dir of a test case path (both relative)."""
+    if library == FLOW:
+        return test_case_path
+    return os.path.dirname(test_case_path)
+
+
+def is_relevant(library, filename):
+    """Return whether the file is part of the test case version.
+
+    This is what the run_*_simulation commands used to look at.
+    """
+    if library == FLOW:
+        return (filename.endswith('.csv') or filename.endswith('.ini') or
+                filename == 'index.txt')
+    return not (filename.endswith('.dia') or filename.startswith('fort.'))
+
+
+def model_names(library, filenames):
+    """Return the test case paths (relative to the dir) of a directory.
+
+    For subgrid, every .mdu is a test case. For flow, a directory with
+    exactly one .ini is a test case itself.
+    """
+    if library == FLOW:
+        if len([f for f in filenames if f.endswith('.ini')]) == 1:
+            return ['']
+        return []
+    return sorted(f for f in filenames if f.endswith('.mdu'))
+
+
+def list_dir(path):
+    """Return (subdirectory names, other names) of a directory.
+
+    Symlinks to directories aren't descended into (like os.walk), so they
+    end up with the other names.
+    """
+    dirnames = []
+    filenames = []
+    if scandir is None:
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                dirnames.append(name)
+            else:
+                filenames.append(name)
+    else:
+        # scandir doesn't need a stat per entry to tell dirs from files.
+        for entry in scandir(path):
+            if entry.is_dir() and not entry.is_symlink():
+                dirnames.append(entry.name)
+            else:
+                filenames.append(entry.name)
+    return sorted(dirnames), sorted(filenames)
+
+
+def version_names(library, dirnames, filenames):
+    """Return the directory entries that can define the test case version.
+
+    For subgrid that's every entry, subdirectories included, like the run
+    command always looked at ``os.listdir()``. For flow only files matter.
+    """
+    if library == FLOW:
+        return filenames
+    return sorted(dirnames + filenames)
+
+
+def file_stats(library, path, filenames):
+    """Return {filename: [size, mtime]} of the relevant entries."""
+    result = {}
+    for filename in filenames:
+        if not is_relevant(library, filename):
+            continue
+        try:
+            stat = os.stat(os.path.join(path, filename))
+        except OSError:
+            continue  # Removed in the meantime.
+        result[filename] = [stat.st_size, stat.st_mtime]
+    return result
+
+
+def last_modified(library, model_dir):
+    """Return the last modification datetime of a model directory.
+
+    This looks at the directory itself, not at the snapshot, so it is always
+    up to date. It's the same as ``Snapshot.last_modified()`` after a refresh.
+    """
+    dirnames, filenames = list_dir(model_dir)
+    stats = file_stats(library, model_dir,
+                       version_names(library, dirnames, filenames))
+    if not stats:
+        return
+    return datetime.datetime.fromtimestamp(
+        max(mtime for size, mtime in stats.values()))
+
+
+class Snapshot(object):
+
+    def __init__(self, library):
+        self.library = library
+        self.root = testbank_root(library)
+        self.path = os.path.join(settings.TESTBANK_SNAPSHOT_DIR,
+                                 'testbank_%s.json' % library.lower())
+        self.dirs = {}
+        if os.path.exists(self.path):
+            try:
+                self.dirs = json.load(open(self.path))
+            except ValueError:
+                logger.warn("Corrupt snapshot %s, starting afresh", self.path)
+
+    def save(self):
+        dir_path = os.path.dirname(self.path)
+        if not os.path.exists(dir_path):
+            os.makedirs(dir_path)
+        with open(self.path + '.tmp', 'w') as snapshot_file:
+            json.dump(self.dirs, snapshot_file)
+        os.rename(self.path + '.tmp', self.path)
+
+    def refresh(self):
+        """Bring the snapshot up to date; return the changed model dirs.
+
+        Changed model dirs are new, removed or modified ones, as paths
+        relative to the test bank root.
+        """
+        start_time = time.time()
+        old_dirs = self.dirs
+        self.dirs = {}
+        num_listed = self._refresh_dir('.', old_dirs)
+        changed = set()
+        for relpath in set(old_dirs) | set(self.dirs):
+            old = old_dirs.get(relpath, {})
+            new = self.dirs.get(relpath, {})
+            if not (old.get('models') or new.get('models')):
+                continue
+            if (old.get('models') != new.get('models') or
+                    old.get('files') != new.get('files')):
+                changed.add(os.path.normpath(relpath))
+        logger.info("Refreshed %s snapshot in %.2fs: listed %s of %s dirs, "
+                    "%s changed model dirs", self.library,
+                    time.time() - start_time, num_listed, len(self.dirs),
+                    len(changed))
+        return changed
+
+    def _refresh_dir(self, relpath, old_dirs):
+        full_path = os.path.join(self.root, relpath)
+        try:
+            mtime = os.stat(full_path).st_mtime
+        except OSError:
+            return 0  # Removed.
+        num_listed = 0
+        old = old_dirs.get(relpath)
+        if old is not None and old['mtime'] == mtime:
+            # Same directory listing as last time.
+            subdirs = old['subdirs']
+            models = old['models']
+            names = old.get('files', {}).keys()
+        else:
+            subdirs, filenames = list_dir(full_path)
+            models = model_names(self.library, filenames)
+            names = version_names(self.library, subdirs, filenames)
+            num_listed += 1
+        entry = {'mtime': mtime, 'subdirs': subdirs, 'models': models}
+        if models:
+            # Files can be modified in place, so always stat those.
+            entry['files'] = file_stats(self.library, full_path, names)
+        self.dirs[relpath] = entry
+        for subdir in subdirs:
+            num_listed += self._refresh_dir(
+                os.path.join(relpath, subdir), old_dirs)
+        return num_listed
+
+    def models(self):
+        """Return the test case paths, relative to the test bank root."""
+        result = []
+        for relpath, entry in self.dirs.items():
+            for name in entry['models']:
+                result.append(os.path.normpath(os.path.join(relpath, name)))
+        return sorted(result)
+
+    def last_modified(self, model_dir):
+        """Return the last modification datetime of a model dir."""
+        # The keys are './<path>' and '.' for the root, like _refresh_dir
+        # builds them.
+        relpath = os.path.normpath(os.path.join('.', model_dir))
+        if relpath != '.':
+            relpath = os.path.join('.', relpath)
+        entry = self.dirs.get(relpath)
+        if not entry or not entry.get('files'):
+            return
+        return datetime.datetime.fromtimestamp(
+            max(mtime for size, mtime in entry['files'].values()))
@@ -0,0 +1,67 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import datetime
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from threedi_verification import models
+from threedi_verification.views import LibraryVersionsView
+
+
+def instruction_reports(right, wrong):
+    return ([{'instruction_id': 'right_%s' % index, 'equal': True}
+             for index in range(right)] +
+            [{'instruction_id': 'wrong_%s' % index, 'equal': False}
+             for index in range(wrong)])
+
+
+class LibraryVersionsViewTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        test_case_versions = []
+        for index in range(5):
+            test_case = models.TestCase.objects.create(
+                path='model_%s.mdu' % index)
+            test_case_versions.append(models.TestCaseVersion.objects.create(
+                test_case=test_case,
+                last_modified=datetime.datetime(2014, 1, 1)))
+        for day in range(1, 4):
+            library_version = models.LibraryVersion.objects.create(
+                last_modified=datetime.datetime(2014, 2, day),
+                num_test_cases=len(test_case_versions))
+            for index, test_case_version in enumerate(test_case_versions):
+                if index == 0:
+                    report = {'log': "Segmentation fault"}
+                else:
+                    report = {'instruction_reports': instruction_reports(
+                        right=index, wrong=1)}
+                models.TestRun.objects.create(
+                    test_case_version=test_case_version,
+                    library_version=library_version,
+                    report=report)
+
+    def render(self):
+        request = RequestFactory().get('/library_versions/')
+        response = LibraryVersionsView.as_view()(request)
+        response.render()
+        return response
+
+    def test_number_of_queries(self):
+        # One for the library versions and one for all their run counts,
+        # however many library versions and test runs there are.
+        with self.assertNumQueries(2):
+            response = self.render()
+        self.assertEqual(response.status_code, 200)
+
+    def test_run_counts(self):
+        view = LibraryVersionsView()
+        for library_version in view.library_versions:
+            self.assertEqual(library_version.run_counts,
+                             {'crashes': 1, 'wrong': 4, 'right': 10})
+            self.assertEqual(len(library_version.num_crashes), 1)
+            self.assertTrue(library_version.is_fully_tested())
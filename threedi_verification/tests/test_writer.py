@@ -0,0 +1,99 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import datetime
+import multiprocessing
+
+from django.db import OperationalError
+from django.db import connection
+from django.test import TransactionTestCase
+
+from threedi_verification.models import InstructionResult
+from threedi_verification.models import LibraryVersion
+from threedi_verification.models import TestCase
+from threedi_verification.models import TestCaseVersion
+from threedi_verification.models import TestRun
+from threedi_verification.writer import ResultWriter
+
+PROCESSES = 4
+RUNS_PER_PROCESS = 30
+CHECKS_PER_RUN = 3
+
+
+def report():
+    return {'status': 'Loaded fine',
+            'model_parameters': [['kmax', '1']],
+            'instruction_reports': [
+                {'instruction_id': 'check_%s' % index,
+                 'parameter': 's1',
+                 'desired': 1.0,
+                 'found': 1.0,
+                 'equal': True}
+                for index in range(CHECKS_PER_RUN)]}
+
+
+def write_test_runs(test_run_ids):
+    """Store the test runs like run_simulations does; return the error."""
+    # Don't share the parent's sqlite connection.
+    connection.close()
+    writer = ResultWriter(batch_size=7, max_seconds=3600)
+    try:
+        for test_run_id in test_run_ids:
+            test_run = TestRun.objects.get(pk=test_run_id)
+            test_run.duration = 1.0
+            writer.add(test_run, report(), log="Simulation finished")
+        writer.flush()
+    except OperationalError as e:
+        return repr(e)
+    finally:
+        connection.close()
+
+
+class ResultWriterTest(TransactionTestCase):
+
+    def setUp(self):
+        library_version = LibraryVersion.objects.create(
+            last_modified=datetime.datetime(2014, 1, 1))
+        self.test_run_ids = []
+        for index in range(PROCESSES * RUNS_PER_PROCESS):
+            test_case = TestCase.objects.create(path='model_%s.mdu' % index)
+            test_case_version = TestCaseVersion.objects.create(
+                test_case=test_case,
+                last_modified=datetime.datetime(2014, 1, 1))
+            self.test_run_ids.append(TestRun.objects.create(
+                test_case_version=test_case_version,
+                library_version=library_version).id)
+
+    def test_batch_size(self):
+        writer = ResultWriter(batch_size=2, max_seconds=3600)
+        first, second = TestRun.objects.filter(id__in=self.test_run_ids[:2])
+        writer.add(first, report())
+        self.assertEqual(len(writer.pending), 1)
+        writer.add(second, report())
+        self.assertEqual(writer.pending, [])
+
+    def test_max_seconds(self):
+        writer = ResultWriter(batch_size=100, max_seconds=0)
+        writer.add(TestRun.objects.get(pk=self.test_run_ids[0]), report())
+        self.assertEqual(writer.pending, [])
+        self.assertEqual(TestRun.objects.get(
+            pk=self.test_run_ids[0]).num_right, CHECKS_PER_RUN)
+
+    def test_concurrent_writers(self):
+        chunks = [self.test_run_ids[start:start + RUNS_PER_PROCESS]
+                  for start in range(0, len(self.test_run_ids),
+                                     RUNS_PER_PROCESS)]
+        connection.close()
+        pool = multiprocessing.Pool(processes=PROCESSES)
+        try:
+            errors = pool.map(write_test_runs, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(errors, [None] * PROCESSES)
+        num_test_runs = len(self.test_run_ids)
+        self.assertEqual(TestRun.objects.filter(
+            status='Loaded fine', duration=1.0).count(), num_test_runs)
+        self.assertEqual(InstructionResult.objects.count(),
+                         num_test_runs * CHECKS_PER_RUN)
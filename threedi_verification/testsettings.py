@@ -2,3 +2,15 @@ from threedi_verification.settings import *
 
 FORCE_SCRIPT_NAME = None
 DEBUG = True
+
+# A file instead of sqlite's default in-memory test database, as the writer
+# tests write to it from several processes.
+DATABASES['default']['TEST_NAME'] = os.path.join(
+    BUILDOUT_DIR, 'var', 'db', 'test_verification.db')
+SOUTH_TESTS_MIGRATE = False
+LOG_STORE_ROOT = os.path.join(BUILDOUT_DIR, 'var', 'test', 'logs')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
@@ -3,7 +3,7 @@ from django.conf.urls import url
 from django.conf.urls.static import static
 from django.contrib import admin
 
-from threedi_verification import views, settings
+from threedi_verification import api, views, settings
 
 admin.autodiscover()
 
@@ -19,6 +19,9 @@ urlpatterns = patterns(
     url(r'^libraries/(?P<pk>\d+)/$',
         views.LibraryVersionView.as_view(),
         name='threedi_verification.library_version'),
+    url(r'^libraries/(?P<old>\d+)/compare/(?P<new>\d+)/$',
+        views.ComparisonView.as_view(),
+        name='threedi_verification.comparison'),
 
     url(r'^test_run/(?P<pk>\d+)/$',
         views.TestRunView.as_view(),
@@ -34,6 +37,19 @@ urlpatterns = patterns(
     url(r'^log/(?P<pk>\d+)/$',
         views.plain_log,
         name='threedi_verification.log'),
+
+    url(r'^api/libraries/$',
+        api.library_versions,
+        name='threedi_verification.api.library_versions'),
+    url(r'^api/libraries/(?P<pk>\d+)/status/$',
+        api.library_version_status,
+        name='threedi_verification.api.library_version_status'),
+    url(r'^api/test_cases/$',
+        api.test_cases,
+        name='threedi_verification.api.test_cases'),
+    url(r'^api/test_runs/$',
+        api.test_runs,
+        name='threedi_verification.api.test_runs'),
 )
 
 # Serving media during development
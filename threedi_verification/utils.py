@@ -1,3 +1,4 @@
+import os
 import subprocess
 import sys
 
@@ -6,6 +7,17 @@ MUST_CLOSE_FDS = not sys.platform.startswith('win')
 
 
 def system(command):
+    exit_code, output, usage = system_with_rusage(command)
+    return exit_code, output
+
+
+def system_with_rusage(command):
+    """Run the command; return exit code, output and its resource usage.
+
+    The resource usage comes from ``os.wait4()``, so it includes the
+    processes the command started and waited for (the simulator under the
+    shell), see ``rusage_dict()``.
+    """
     # Copy/pasted from zc.buildout.
     p = subprocess.Popen(command,
                          shell=True,
@@ -19,5 +31,26 @@ def system(command):
     o.close()
     e.close()
     output = result.decode()
-    exit_code = p.wait()
-    return exit_code, output
+    pid, status, rusage = os.wait4(p.pid, 0)
+    # Like Popen.wait() would: negative signal number if killed.
+    if os.WIFSIGNALED(status):
+        p.returncode = -os.WTERMSIG(status)
+    else:
+        p.returncode = os.WEXITSTATUS(status)
+    return p.returncode, output, rusage_dict(rusage)
+
+
+def rusage_dict(rusage):
+    """Return the interesting parts of a resource.struct_rusage."""
+    max_rss = rusage.ru_maxrss / 1024.0  # Kilobytes on linux.
+    if sys.platform == 'darwin':
+        max_rss = max_rss / 1024.0  # Bytes on OSX.
+    return dict(
+        max_rss=round(max_rss, 1),
+        user_time=round(rusage.ru_utime, 3),
+        system_time=round(rusage.ru_stime, 3),
+        block_input=rusage.ru_inblock,
+        block_output=rusage.ru_oublock,
+        voluntary_switches=rusage.ru_nvcsw,
+        involuntary_switches=rusage.ru_nivcsw,
+    )
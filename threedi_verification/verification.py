@@ -4,7 +4,9 @@ models and to create reports about them.
 
 """
 from __future__ import print_function
+from collections import OrderedDict
 from collections import defaultdict
+from contextlib import contextmanager
 import ConfigParser
 import argparse
 import csv
@@ -13,9 +15,15 @@ import json
 import logging
 import os
 import glob
+import hashlib
 import math
+import multiprocessing
+import shutil
+import tarfile
+import time
 from django.conf import settings
-from jinja2 import Environment, PackageLoader
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
+from jinja2 import meta
 from netCDF4 import Dataset
 import numpy as np
 
@@ -23,22 +31,34 @@ import matplotlib
 matplotlib.use('Agg')  # needs to be at top of module
 import matplotlib.pyplot as plt
 
-from threedi_verification.utils import system
+from threedi_verification.utils import system_with_rusage
 
-jinja_env = Environment(loader=PackageLoader('threedi_verification',
-                                             'templates'))
 logger = logging.getLogger(__name__)
 
 OUTDIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
                                       '..', 'var', 'html'))
+JINJA_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                               '..', 'var', 'cache', 'jinja'))
 ARCHIVEDIR = os.path.join(OUTDIR, 'archive')
 TIMESTAMPED_OUTDIR = os.path.join(
     ARCHIVEDIR, datetime.datetime.now().strftime('%Y-%m-%d_%H%M'))
 CRASHED = 'Calculation core crashes'
 SOME_ERROR = 'Model loading problems'
 LOADED = 'Loaded fine'
+# Static files (copied into OUTDIR) that the report pages refer to.
+STATIC_ENTRIES = ('bootstrap', 'custom.css', 'custom.js')
+DIGESTS_FILENAME = 'digests.json'
+ARCHIVE_MANIFEST = os.path.join(ARCHIVEDIR, 'manifest.jsonl')
+ARCHIVE_PAGE_SIZE = 100
+ARCHIVE_MAX_AGE_DAYS = 90  # Older archive dirs are compacted into a .tar.gz
+ARCHIVE_COMPACT_INTERVAL = datetime.timedelta(days=1)
+ARCHIVE_COMPACT_STAMP = os.path.join(ARCHIVEDIR, 'last_compaction')
+MANIFEST_BLOCK_SIZE = 8192  # Bytes read at a time from the end.
+RENDER_WORKERS = multiprocessing.cpu_count()
 
 EPSILON = 0.000001
+SPATIAL_PLOT_WIDTH = 200  # pixels
+SUM_CHUNK_SIZE = 1000000  # max number of values read at once for 'SUM' plots
 
 INVALID_DESIRED_VALUE = 1234567890  # Hardcoded in the template, too.
 MODEL_PARAMETERS = (
@@ -53,6 +73,28 @@ MODEL_PARAMETERS = (
 )
 
 
+def jinja_bytecode_cache():
+    """Return a bytecode cache so that templates are compiled only once.
+
+    Without it, every run re-parses and re-compiles all templates. The
+    cache is keyed on the template source, so template changes are picked up
+    automatically.
+    """
+    if not os.path.exists(JINJA_CACHE_DIR):
+        try:
+            os.makedirs(JINJA_CACHE_DIR)
+        except OSError:
+            logger.warn("Can't create %s, not caching templates",
+                        JINJA_CACHE_DIR)
+            return
+    return FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+
+jinja_env = Environment(loader=PackageLoader('threedi_verification',
+                                             'templates'),
+                        bytecode_cache=jinja_bytecode_cache())
+
+
 def unmask(something):
     """Some numbers come out as numpy masked numbers. Fix that.
 
@@ -65,6 +107,33 @@ def unmask(something):
         return str(something)
 
 
+class Timings(object):
+    """Accumulated durations of the phases of a test run."""
+
+    def __init__(self):
+        self.spans = OrderedDict()
+
+    def add(self, name, seconds):
+        span = self.spans.setdefault(name, {'seconds': 0.0, 'count': 0})
+        span['seconds'] += seconds
+        span['count'] += 1
+
+    @contextmanager
+    def span(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start_time)
+
+    def as_list(self):
+        """Return [{name, seconds, count}], in the order of first use."""
+        return [dict(name=name,
+                     seconds=round(span['seconds'], 4),
+                     count=span['count'])
+                for name, span in self.spans.items()]
+
+
 class InstructionReport(object):
 
     def __init__(self):
@@ -80,6 +149,8 @@ class InstructionReport(object):
         self.what = []
         self.instruction_id = None
         self.image_relpath = None
+        self.spatial_image_relpath = None
+        self.plot_seconds = 0.0  # Not in the report, see Timings.
 
     def __cmp__(self, other):
         return cmp(self.id, other.id)
@@ -103,6 +174,7 @@ class InstructionReport(object):
             margin_found=unmask(self.margin_found),
             instruction_id=self.instruction_id,
             image_relpath=self.image_relpath,
+            spatial_image_relpath=self.spatial_image_relpath,
         )
 
     @property
@@ -162,6 +234,8 @@ class MduReport(object):
         self.index_lines = []
         self.csv_contents = []
         self.model_parameters = []
+        self.timings = Timings()
+        self.rusage = {}  # Of the simulator, see utils.rusage_dict().
 
         # test_run_id is needed to uniquely save the plots
         self.test_run_id = test_run_id
@@ -173,9 +247,11 @@ class MduReport(object):
         # Basically: what ends up in mdu.html as context.
         result = dict(
             loadable=self.loadable,
+            status=self.status,
             short_title=self.short_title,
             index_lines=self.index_lines,
-            log=self.log,
+            # Only the tail: the full log goes into the log store.
+            log=self.log and self.log_summary or None,
             successfully_loaded_log=None,  # No verbosity at the moment
             log_summary=self.log and self.log_summary or None,
             csv_contents=self.csv_contents,
@@ -263,9 +339,11 @@ class InpReport(MduReport):
         # Basically: what ends up in mdu.html as context.
         result = dict(
             loadable=self.loadable,
+            status=self.status,
             short_title=self.short_title,
             index_lines=self.index_lines,
-            log=self.log,
+            # Only the tail: the full log goes into the log store.
+            log=self.log and self.log_summary or None,
             successfully_loaded_log=None,  # No verbosity at the moment
             log_summary=self.log and self.log_summary or None,
             csv_contents=self.csv_contents,
@@ -315,30 +393,20 @@ class Report(object):
 
     def write_template(self, template_name, outfile=None, title=None,
                        context=None):
+        """Render the template once and hardlink it into the archive."""
         if context is None:
             context = {}
-        if not os.path.exists(TIMESTAMPED_OUTDIR):
-            os.mkdir(TIMESTAMPED_OUTDIR)
         if outfile is None:
             outfile = template_name
-        outfile1 = os.path.join(OUTDIR, outfile)
-        outfile2 = os.path.join(TIMESTAMPED_OUTDIR, outfile)
-        template = jinja_env.get_template(template_name)
-        open(outfile1, 'w').write(template.render(view=self,
-                                                  title=title,
-                                                  context=context))
-        static = '../../'
-        open(outfile2, 'w').write(template.render(view=self,
-                                                  title=title,
-                                                  context=context,
-                                                  static=static))
-        logger.debug("Wrote %s and %s", outfile1, outfile2)
+        render_page((template_name, os.path.join(OUTDIR, outfile), title,
+                     context, self))
+        archive_page(outfile)
 
     def _propagate_ids(self):
         for mdu_id in self.mdu_reports:
             mdu_report = self.mdu_reports[mdu_id]
             mdu_report.id = mdu_id
-            mdu_report._propagage_ids()
+            mdu_report._propagate_ids()
 
     @property
     def mdus(self):
@@ -354,12 +422,12 @@ class Report(object):
         return [mdu for mdu in self.mdus
                 if mdu.status not in [CRASHED, SOME_ERROR]]
 
-    @property
-    def summary_items(self):
-        result = []
+    def summary_counts(self):
+        """Return numbers of mdus per status and of tests per result."""
+        result = OrderedDict()
         for status in [CRASHED, SOME_ERROR, LOADED]:
             number = len([mdu for mdu in self.mdus if mdu.status == status])
-            result.append("%s: %s" % (status, number))
+            result[status] = number
         successful_tests = 0
         failed_tests = 0
         errored_tests = 0
@@ -371,20 +439,148 @@ class Report(object):
                     errored_tests += 1
                 else:
                     failed_tests += 1
-        result.append("Tests with setup errors: %s" % errored_tests)
-        result.append("Failed tests: %s" % failed_tests)
-        result.append("Successful tests: %s" % successful_tests)
+        result["Tests with setup errors"] = errored_tests
+        result["Failed tests"] = failed_tests
+        result["Successful tests"] = successful_tests
         return result
 
-    def export_reports(self):
+    @property
+    def summary_items(self):
+        return ["%s: %s" % item for item in self.summary_counts().items()]
+
+    def export_reports(self, workers=RENDER_WORKERS):
+        """Write index.html and one page per mdu, skipping unchanged pages.
+
+        A page is only rendered if the digest of its template and report
+        differs from the one stored at the previous export. The mdu pages are
+        rendered in parallel by a pool of ``workers`` processes.
+        """
         self._propagate_ids()
-        self.write_template('index.html',
-                            title='Overview')
+        digests_file = os.path.join(OUTDIR, DIGESTS_FILENAME)
+        old_digests = {}
+        if os.path.exists(digests_file):
+            old_digests = json.load(open(digests_file))
+        new_digests = {}
+
+        def needs_rendering(outfile, digest):
+            new_digests[outfile] = digest
+            if old_digests.get(outfile) != digest:
+                return True
+            return not os.path.exists(os.path.join(OUTDIR, outfile))
+
+        jobs = []
+        index_digest = report_digest(
+            template_digest('index.html'),
+            [mdu.as_dict() for mdu in self.mdus])
+        if needs_rendering('index.html', index_digest):
+            # The index needs the report itself as view, so we render it
+            # here instead of pickling everything over to a worker.
+            render_page(('index.html', os.path.join(OUTDIR, 'index.html'),
+                         'Overview', {}, self))
+        mdu_template_digest = template_digest('mdu.html')
         for mdu in self.mdu_reports.values():
-            self.write_template('mdu.html',
-                                title=mdu.title,
-                                outfile=mdu.details_filename,
-                                context=mdu)
+            outfile = mdu.details_filename
+            # as_dict() only has the tail of the log, the page shows it all.
+            digest = report_digest(mdu_template_digest, mdu.as_dict(),
+                                   log=mdu.log)
+            if needs_rendering(outfile, digest):
+                jobs.append(('mdu.html', os.path.join(OUTDIR, outfile),
+                             mdu.title, mdu, None))
+        logger.info("Rendering %s of %s mdu pages", len(jobs),
+                    len(self.mdu_reports))
+
+        if workers > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(processes=workers)
+            try:
+                pool.map(render_page, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                render_page(job)
+
+        for outfile in new_digests:
+            archive_page(outfile)
+        with open(digests_file + '.tmp', 'w') as f:
+            json.dump(new_digests, f)
+        os.rename(digests_file + '.tmp', digests_file)
+
+
+def template_digest(template_name):
+    """Return a digest of the template source and of the templates it uses.
+
+    Part of the page digests, so that a deploy with changed templates
+    renders all pages again.
+    """
+    names = set()
+    todo = [template_name]
+    while todo:
+        name = todo.pop()
+        if name in names:
+            continue
+        names.add(name)
+        source = jinja_env.loader.get_source(jinja_env, name)[0]
+        todo.extend(referenced for referenced in
+                    meta.find_referenced_templates(jinja_env.parse(source))
+                    if referenced is not None)
+    digest = hashlib.md5()
+    for name in sorted(names):
+        source = jinja_env.loader.get_source(jinja_env, name)[0]
+        digest.update(name.encode('utf-8'))
+        digest.update(source.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def report_digest(template_digest, report, log=None):
+    """Return a digest of the template, the (json-able) report and the log.
+    """
+    digest = hashlib.md5(template_digest)
+    digest.update(json.dumps(report, sort_keys=True, default=repr))
+    if log:
+        if isinstance(log, unicode):
+            log = log.encode('utf-8')
+        digest.update(log)
+    return digest.hexdigest()
+
+
+def render_page(job):
+    """Render one page to a file.
+
+    The job is a (template_name, outfile, title, context, view) tuple so that
+    this can be used with a process pool. The file is written under a
+    temporary name and then moved into place: the previous version might be
+    hardlinked into the archive and must not be overwritten.
+    """
+    template_name, outfile, title, context, view = job
+    template = jinja_env.get_template(template_name)
+    content = template.render(view=view, title=title, context=context)
+    open(outfile + '.tmp', 'w').write(content)
+    os.rename(outfile + '.tmp', outfile)
+    logger.debug("Wrote %s", outfile)
+
+
+def archive_page(outfile):
+    """Hardlink a page from OUTDIR into the timestamped archive dir.
+
+    The pages use static paths relative to their own directory, so the
+    archive dir gets relative symlinks to the static files in OUTDIR.
+    """
+    if not os.path.exists(TIMESTAMPED_OUTDIR):
+        os.mkdir(TIMESTAMPED_OUTDIR)
+    for entry in STATIC_ENTRIES:
+        link = os.path.join(TIMESTAMPED_OUTDIR, entry)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join('..', '..', entry), link)
+    source = os.path.join(OUTDIR, outfile)
+    target = os.path.join(TIMESTAMPED_OUTDIR, outfile)
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Different file system, for instance.
+        shutil.copyfile(source, target)
 
 
 def _desired_time_index(instruction, instruction_report, dataset):
@@ -802,31 +998,121 @@ def check_map_nflow(instruction, instruction_report, dataset,
 def plot_it(dataset, parameter_name, desired_time_index, location_index,
             instruction_report, instruction_id=None, test_run_id=None):
     """Helper function for calling the actual plotting function"""
-    if not np.isscalar(location_index):  # type(location_index) == slice
-        # TODO: implement if location index is a range of values
-        logger.debug("Can't plot because of 'SUM' of location_index")
-        logger.debug("location_index: %s", location_index)
-        return
-    if not np.isscalar(desired_time_index):
-        # TODO: implement plotting when using a range of time values
-        logger.debug("Can't plot because of 'SUM' of desired_time_index")
-        logger.debug("desired_time_index: %s", desired_time_index)
-        return
+    is_sum = not (np.isscalar(location_index) and
+                  np.isscalar(desired_time_index))
+    if is_sum:
+        logger.debug("Plotting aggregated values because of 'SUM' "
+                     "(time index: %s, location index: %s)",
+                     desired_time_index, location_index)
 
     if instruction_id:
-        # construct MEDIA_ROOT path for saving images while preserving model
-        # dir structure
-        cwd = os.getcwd()
-        model_relpath = os.path.relpath(cwd, settings.BUILDOUT_DIR)
+        start_time = time.time()
+        try:
+            _plot_it(dataset, parameter_name, desired_time_index,
+                     location_index, instruction_report, instruction_id,
+                     test_run_id, is_sum)
+        finally:
+            instruction_report.plot_seconds += time.time() - start_time
+
+
+def _plot_it(dataset, parameter_name, desired_time_index, location_index,
+             instruction_report, instruction_id, test_run_id, is_sum):
+    """Make the time (or SUM) plot and the spatial plot, if possible."""
+    # construct MEDIA_ROOT path for saving images while preserving model
+    # dir structure
+    cwd = os.getcwd()
+    model_relpath = os.path.relpath(cwd, settings.BUILDOUT_DIR)
+
+    # NOTE: test_run_id is to identify the plots per test run
+    img_path = os.path.join(
+        settings.MEDIA_ROOT, model_relpath, str(test_run_id),
+        instruction_id + '.png')
+    instruction_report.image_relpath = os.path.relpath(img_path,
+                                                       settings.MEDIA_ROOT)
+    if is_sum:
+        make_sum_plot(dataset, parameter_name, desired_time_index,
+                      location_index, imgname=img_path)
+        return
+
+    make_time_plot(dataset, parameter_name, desired_time_index,
+                   location_index, imgname=img_path)
 
-        # NOTE: test_run_id is to identify the plots per test run
-        img_path = os.path.join(
+    if has_cell_values(dataset, parameter_name):
+        spatial_img_path = os.path.join(
             settings.MEDIA_ROOT, model_relpath, str(test_run_id),
-            instruction_id + '.png')
-        instruction_report.image_relpath = os.path.relpath(img_path,
-                                                           settings.MEDIA_ROOT)
-        make_time_plot(dataset, parameter_name, desired_time_index,
-                       location_index, imgname=img_path)
+            instruction_id + '_spatial.png')
+        instruction_report.spatial_image_relpath = os.path.relpath(
+            spatial_img_path, settings.MEDIA_ROOT)
+        make_spatial_plot(dataset, parameter_name, desired_time_index,
+                          location_index, imgname=spatial_img_path)
+
+
+def aggregated_series(variable, location_idx, chunk_size=SUM_CHUNK_SIZE):
+    """Return the values per time step, summed over the location index.
+
+    The variable is read in blocks of whole time steps of at most
+    ``chunk_size`` values, so the complete (time, n) array never needs to be
+    in memory. Masked values are returned as NaN.
+    """
+    n_time_indices = variable.shape[0]
+    if np.isscalar(location_idx):
+        series = variable[:, location_idx]
+        return np.ma.filled(np.ma.asarray(series, dtype=float), np.nan)
+
+    n_locations = len(range(*location_idx.indices(variable.shape[1])))
+    rows_per_chunk = max(1, chunk_size // max(n_locations, 1))
+    series = np.empty(n_time_indices)
+    for start in range(0, n_time_indices, rows_per_chunk):
+        stop = min(start + rows_per_chunk, n_time_indices)
+        block = np.ma.asarray(variable[start:stop, location_idx],
+                              dtype=float)
+        series[start:stop] = np.ma.filled(block.sum(1), np.nan)
+    return series
+
+
+def make_sum_plot(dataset, parameter, time_idx, location_idx, imgname=None):
+    """
+    Make a plot of the aggregated parameter w.r.t. time for 'SUM' checks
+
+    Params:
+        dataset: netcdf dataset
+        parameter: the quantity
+        time_idx: index of the time value or a slice if 'SUM' is used for
+                  the time; in that case there's no single point to mark
+        location_idx: the node index or a slice if 'SUM' is used for the
+                      location; the values are summed per time step then
+        imgname: full path to img file
+    """
+    if not imgname:
+        raise Exception("No image name given")
+    values = dataset.variables[parameter]
+    logger.debug("Shape before aggregating for the plot: %r", values.shape)
+    series = aggregated_series(values, location_idx)
+
+    plt.plot(series)
+    if np.isscalar(time_idx):
+        plt.plot(time_idx, series[time_idx], 'ro')
+        plt.axvline(x=time_idx, color='red', linestyle='--')
+    else:
+        # The whole series is summed, so shade all of it.
+        plt.fill_between(np.arange(len(series)), series, alpha=0.3)
+    plt.ticklabel_format(useOffset=False)
+
+    # ticks
+    plt.locator_params(axis='x', nbins=4, tight=False)  # reduce ticks
+    plt.locator_params(axis='y', nbins=5, tight=False)  # reduce ticks
+
+    # make dir if it doesn't exist
+    dir_path = os.path.dirname(imgname)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+    # save it
+    F = plt.gcf()
+    DefaultSize = F.get_size_inches()
+    F.set_size_inches((DefaultSize[0]*0.2, DefaultSize[1]*0.2))
+    F.savefig(imgname, dpi=50, bbox_inches='tight')
+    plt.close("all")
 
 
 def make_time_plot(dataset, parameter, time_idx, location_idx,
@@ -896,13 +1182,122 @@ def make_time_plot(dataset, parameter, time_idx, location_idx,
     plt.close("all")
 
 
-def make_spatial_plot():
-    pass
-    # xcc = dataset.variables['FlowElem_xcc']
-    # ycc = dataset.variables['FlowElem_ycc']
-    # v = values[:,-1]
-    # N = matplotlib.colors.Normalize(9.5-(1e-6), 9.5 + (1e-6))
-    # plt.scatter(xcc, ycc, c=matplotlib.cm.hsv(N(v)), s=10, edgecolor='none')
+def _cell_centers(dataset):
+    """Return x and y arrays of the cell ("FlowElem") centers."""
+    if 'FlowElem_xcc' in dataset.variables:
+        return (dataset.variables['FlowElem_xcc'][:],
+                dataset.variables['FlowElem_ycc'][:])
+    # Older netcdfs only have the contours.
+    return (dataset.variables['FlowElemContour_x'][:].mean(1),
+            dataset.variables['FlowElemContour_y'][:].mean(1))
+
+
+def has_cell_values(dataset, parameter):
+    """Return whether the parameter is defined per cell (and not per link)."""
+    if not ('FlowElem_xcc' in dataset.variables or
+            'FlowElemContour_x' in dataset.variables):
+        return False
+    if 'FlowElem_xcc' in dataset.variables:
+        cell_dimension = dataset.variables['FlowElem_xcc'].dimensions[0]
+    else:
+        cell_dimension = dataset.variables['FlowElemContour_x'].dimensions[0]
+    dimensions = dataset.variables[parameter].dimensions
+    return len(dimensions) == 2 and dimensions[-1] == cell_dimension
+
+
+def rasterise(x, y, values, width, height, extent):
+    """Bin cell values into a (height, width) image with the mean per pixel.
+
+    This is O(n) in the number of cells with only numpy operations, so the
+    cost of the plot itself doesn't depend on the grid size anymore. Pixels
+    without any cell are NaN.
+    """
+    xmin, xmax, ymin, ymax = extent
+    xrange_ = (xmax - xmin) or 1.0
+    yrange_ = (ymax - ymin) or 1.0
+    cols = ((x - xmin) / xrange_ * (width - 1)).astype(np.intp)
+    rows = ((ymax - y) / yrange_ * (height - 1)).astype(np.intp)
+    pixels = rows * width + cols
+    sums = np.bincount(pixels, weights=values, minlength=width * height)
+    counts = np.bincount(pixels, minlength=width * height)
+    image = np.empty(width * height)
+    image.fill(np.nan)
+    filled = counts > 0
+    image[filled] = sums[filled] / counts[filled]
+    return image.reshape(height, width)
+
+
+def make_spatial_plot(dataset, parameter, time_idx, location_idx,
+                      imgname=None, width=SPATIAL_PLOT_WIDTH):
+    """
+    Make a map of the parameter at one time with the checked cell highlighted
+
+    The old approach (``plt.scatter`` of every cell center) is way too slow
+    on grids with millions of cells. Instead, the values are binned straight
+    into a numpy RGBA buffer of the target size which is written in one go.
+
+    Params:
+        dataset: netcdf dataset
+        parameter: the quantity (must be defined per cell)
+        time_idx: index of the time value
+        location_idx: index of the checked cell
+        imgname: full path to img file
+        width: width of the image in pixels; the height follows the extent
+    """
+    if not imgname:
+        raise Exception("No image name given")
+    x, y = _cell_centers(dataset)
+    x = np.ma.filled(np.ma.asarray(x, dtype=float), np.nan)
+    y = np.ma.filled(np.ma.asarray(y, dtype=float), np.nan)
+    values = np.ma.filled(
+        np.ma.asarray(dataset.variables[parameter][time_idx, :], dtype=float),
+        np.nan)
+    logger.debug("Rasterising %s cells for the spatial plot", len(values))
+
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.any():
+        logger.warn("No valid cell coordinates, skipping spatial plot")
+        return
+    extent = (x[valid].min(), x[valid].max(), y[valid].min(), y[valid].max())
+    xrange_ = extent[1] - extent[0]
+    yrange_ = extent[3] - extent[2]
+    if xrange_ > 0 and yrange_ > 0:
+        height = int(round(width * yrange_ / xrange_))
+        height = min(max(height, 1), 2 * width)
+    else:
+        height = width
+
+    has_value = valid & np.isfinite(values)
+    image = rasterise(x[has_value], y[has_value], values[has_value],
+                      width, height, extent)
+
+    # Colour the pixels ourselves so that no figure is needed at all.
+    filled = np.isfinite(image)
+    rgba = np.zeros((height, width, 4))
+    if filled.any():
+        vmin = image[filled].min()
+        vmax = image[filled].max()
+        normalize = matplotlib.colors.Normalize(vmin, vmax)
+        rgba[filled] = plt.get_cmap('Blues')(normalize(image[filled]))
+
+    # Highlight the checked cell with a red square.
+    if valid[location_idx]:
+        col = int((x[location_idx] - extent[0]) / (xrange_ or 1.0) *
+                  (width - 1))
+        row = int((extent[3] - y[location_idx]) / (yrange_ or 1.0) *
+                  (height - 1))
+        top, bottom = max(row - 3, 0), min(row + 3, height - 1)
+        left, right = max(col - 3, 0), min(col + 3, width - 1)
+        red = (1.0, 0.0, 0.0, 1.0)
+        rgba[top:bottom + 1, [left, right]] = red
+        rgba[[top, bottom], left:right + 1] = red
+
+    # make dir if it doesn't exist
+    dir_path = os.path.dirname(imgname)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+    plt.imsave(imgname, rgba)
 
 
 def check_csv(csv_filename, netcdf_path=None, mdu_report=None, is_his=False):
@@ -917,25 +1312,38 @@ def check_csv(csv_filename, netcdf_path=None, mdu_report=None, is_his=False):
         instructions = list(csv.DictReader(csvfile, delimiter=';'))
     mdu_report.record_instructions(instructions, csv_filename)
 
-    with Dataset(netcdf_path) as dataset:
+    timings = mdu_report.timings
+    with timings.span('open netcdf'):
+        dataset = Dataset(netcdf_path)
+    with dataset:
         for test_number, instruction in enumerate(instructions):
             instruction_id = "{} - {}".format(
                 os.path.splitext(csv_filename)[0], str(test_number))
             instruction_report = mdu_report.instruction_reports[instruction_id]
             instruction_report.instruction_id = instruction_id
 
+            start_time = time.time()
             # The checks are built around some ad hoc patterns:
             if is_his:
+                check_name = 'check_his'
                 check_his(instruction, instruction_report, dataset)
             else:
                 if ('nFlowLink' in instruction or 'nFlowElem' in instruction):
+                    check_name = 'check_map_nflow'
                     check_map_nflow(instruction, instruction_report, dataset,
                                     instruction_id=instruction_id,
                                     test_run_id=mdu_report.test_run_id)
                 else:
+                    check_name = 'check_map'
                     check_map(instruction, instruction_report, dataset,
                               instruction_id=instruction_id,
                               test_run_id=mdu_report.test_run_id)
+            # The plotting is timed separately.
+            plot_seconds = instruction_report.plot_seconds
+            timings.add(check_name,
+                        time.time() - start_time - plot_seconds)
+            if plot_seconds:
+                timings.add('plot', plot_seconds)
 
 
 def model_parameters(mdu_filepath):
@@ -985,6 +1393,19 @@ def check_mdu_file(mdu_filepath):
                 return msg
 
 
+def simulator_command(simulator, model_file):
+    """Return the command line to run the simulator on the model file.
+
+    The simulators run inside the model directory, so a relative simulator
+    (the first word, like ``bin/fake_simulator``) is made relative to the
+    buildout directory.
+    """
+    words = simulator.split(' ', 1)
+    if os.sep in words[0] and not os.path.isabs(words[0]):
+        words[0] = os.path.join(settings.BUILDOUT_DIR, words[0])
+    return '%s %s' % (' '.join(words), model_file)
+
+
 def run_flow_simulation(model_dir, inp_report=None, verbose=False):
     """
     Run simulation using python-flow
@@ -999,9 +1420,7 @@ def run_flow_simulation(model_dir, inp_report=None, verbose=False):
     if 'index.txt' in os.listdir('.'):
         inp_report.index_lines = open('index.txt').readlines()
     logger.debug("Loading %s...", model_dir)
-    buildout_dir = original_dir
 
-    pyflow = os.path.join(buildout_dir, 'bin', 'pyflow')
     ini_files = glob.glob(os.path.join(os.path.abspath(model_dir), '*.ini'))
     if len(ini_files) != 1:
         logger.error("No or more than one ini file found. ini_files: %s",
@@ -1010,9 +1429,11 @@ def run_flow_simulation(model_dir, inp_report=None, verbose=False):
     ini_file = ini_files[0]
     ini_name = os.path.splitext(ini_file)[0]
     variant_dir = os.path.join(model_dir, ini_name)
-    cmd = '%s %s -m -o debug' % (pyflow, ini_file)
+    cmd = '%s -m -o debug' % simulator_command(settings.FLOW_SIMULATOR,
+                                               ini_file)
     logger.debug("Running %s", cmd)
-    exit_code, output = system(cmd)
+    with inp_report.timings.span('simulation'):
+        exit_code, output, inp_report.rusage = system_with_rusage(cmd)
     last_output = ''.join(output.split('\n')[-2:]).lower()
 
     if verbose:
@@ -1035,18 +1456,20 @@ def run_flow_simulation(model_dir, inp_report=None, verbose=False):
         for csv_filename in csv_filenames:
             logger.info("Reading instructions from %s", csv_filename)
             netcdf_path = os.path.join(ini_name, 'results/subgrid_map.nc')
-            check_csv(csv_filename, netcdf_path, mdu_report=inp_report)
+            with inp_report.timings.span('csv %s' % csv_filename):
+                check_csv(csv_filename, netcdf_path, mdu_report=inp_report)
 
     # Cleanup results
-    for f in os.listdir(os.path.join(variant_dir,'results')):
-        item = os.path.join(os.path.join(variant_dir,'results'), f)
-        if os.path.isfile(item):
-            os.remove(item)
-    # Also delete makegrid files because of interference with 'hg update'
-    for f in os.listdir(os.path.join(variant_dir, 'preprocessed')):
-        item = os.path.join(os.path.join(variant_dir, 'preprocessed'), f)
-        if os.path.isfile(item):
-            os.remove(item)
+    with inp_report.timings.span('cleanup'):
+        for f in os.listdir(os.path.join(variant_dir,'results')):
+            item = os.path.join(os.path.join(variant_dir,'results'), f)
+            if os.path.isfile(item):
+                os.remove(item)
+        # Also delete makegrid files because of interference with 'hg update'
+        for f in os.listdir(os.path.join(variant_dir, 'preprocessed')):
+            item = os.path.join(os.path.join(variant_dir, 'preprocessed'), f)
+            if os.path.isfile(item):
+                os.remove(item)
 
     os.chdir(original_dir)
 
@@ -1071,14 +1494,12 @@ def run_subgrid_simulation(mdu_filepath, mdu_report=None, verbose=False):
     # cmd = '/opt/3di/bin/subgridf90 %s --autostartstop --nodisplay' % os.path.basename(
     #     mdu_filepath)
     # ^^^ Direct subgrid executable call
-    # Below: new via-the-library call
-    buildout_dir = original_dir
-    # kill_after_timeout_command = "timeout 5m"
-    #subgridpy = os.path.join(buildout_dir, 'bin', 'subgridpy')
-    subgridpy = os.path.join(buildout_dir, 'bin', 'simplesubgrid')
-    cmd = '%s %s' % (subgridpy, os.path.basename(mdu_filepath))
+    # Below: new via-the-library call, see SUBGRID_SIMULATOR in settings.py
+    cmd = simulator_command(settings.SUBGRID_SIMULATOR,
+                            os.path.basename(mdu_filepath))
     logger.debug("Running %s", cmd)
-    exit_code, output = system(cmd)
+    with mdu_report.timings.span('simulation'):
+        exit_code, output, mdu_report.rusage = system_with_rusage(cmd)
     last_output = ''.join(output.split('\n')[-2:]).lower()
     if verbose:
         logger.info(output)
@@ -1105,12 +1526,14 @@ def run_subgrid_simulation(mdu_filepath, mdu_report=None, verbose=False):
                 is_his = True
             else:
                 netcdf_path = 'subgrid_map.nc'
-            check_csv(csv_filename, netcdf_path, mdu_report=mdu_report,
-                      is_his=is_his)
+            with mdu_report.timings.span('csv %s' % csv_filename):
+                check_csv(csv_filename, netcdf_path, mdu_report=mdu_report,
+                          is_his=is_his)
 
     # Cleanup: zap *.nc files.
-    for nc in [f for f in os.listdir('.') if f.endswith('.nc')]:
-        os.remove(nc)
+    with mdu_report.timings.span('cleanup'):
+        for nc in [f for f in os.listdir('.') if f.endswith('.nc')]:
+            os.remove(nc)
 
     os.chdir(original_dir)
 
@@ -1124,20 +1547,238 @@ def mdu_filepaths(basedir):
             yield os.path.join(dirpath, mdu_filename)
 
 
-def create_archive_index():
-    """Write an index.html file for the archive/* directories."""
-    archive_dirs = [filename for filename in os.listdir(ARCHIVEDIR)
-                    if os.path.isdir(os.path.join(ARCHIVEDIR, filename))]
-    archive_dirs.sort()
-    archive_dirs.reverse()
+def _ensure_archive_manifest():
+    """Create the manifest from the existing archive directories if needed.
+    """
+    if os.path.exists(ARCHIVE_MANIFEST):
+        return
+    archive_dirs = sorted(
+        [filename for filename in os.listdir(ARCHIVEDIR)
+         if os.path.isdir(os.path.join(ARCHIVEDIR, filename))])
+    write_archive_manifest([{'name': archive_dir, 'summary': {}}
+                            for archive_dir in archive_dirs])
+
+
+def read_archive_manifest():
+    """Return the archive entries, oldest first.
+
+    The manifest is an append-only file with one json entry per line. It is
+    created from the existing archive directories if it doesn't exist yet.
+    This reads the whole file, see read_archive_tail() for the cheap way.
+    """
+    _ensure_archive_manifest()
+    with open(ARCHIVE_MANIFEST) as manifest:
+        return [json.loads(line) for line in manifest if line.strip()]
+
+
+def write_archive_manifest(entries):
+    """Replace the manifest (and its entry count) by the given entries."""
+    with open(ARCHIVE_MANIFEST + '.tmp', 'w') as manifest:
+        for entry in entries:
+            manifest.write(json.dumps(entry) + '\n')
+    os.rename(ARCHIVE_MANIFEST + '.tmp', ARCHIVE_MANIFEST)
+    _write_archive_manifest_length(len(entries))
+
+
+def _write_archive_manifest_length(length):
+    """Store the number of entries and the manifest size they belong to."""
+    count_filename = ARCHIVE_MANIFEST + '.count'
+    with open(count_filename + '.tmp', 'w') as count_file:
+        count_file.write('%s %s\n' % (length,
+                                      os.path.getsize(ARCHIVE_MANIFEST)))
+    os.rename(count_filename + '.tmp', count_filename)
+
+
+def archive_manifest_length():
+    """Return the number of entries, kept in a small file next to it.
+
+    The count file also has the size of the manifest it was written for. If
+    that doesn't match (a crash between appending an entry and updating the
+    count, for instance) or the count file is missing, the entries are
+    counted again.
+    """
+    _ensure_archive_manifest()
+    count_filename = ARCHIVE_MANIFEST + '.count'
+    try:
+        with open(count_filename) as count_file:
+            length, size = [int(value) for value in count_file.read().split()]
+        if size == os.path.getsize(ARCHIVE_MANIFEST):
+            return length
+    except (IOError, ValueError):
+        pass
+    logger.info("Counting the entries of %s again", ARCHIVE_MANIFEST)
+    length = len(read_archive_manifest())
+    _write_archive_manifest_length(length)
+    return length
+
+
+def append_archive_entry(entry):
+    length = archive_manifest_length()
+    with open(ARCHIVE_MANIFEST, 'a') as manifest:
+        manifest.write(json.dumps(entry) + '\n')
+    _write_archive_manifest_length(length + 1)
+
+
+def read_archive_tail(number):
+    """Return the last ``number`` archive entries, oldest first.
+
+    The manifest is read backwards in blocks, so this takes the same time
+    however large the archive is.
+    """
+    _ensure_archive_manifest()
+    if number <= 0:
+        return []
+    with open(ARCHIVE_MANIFEST, 'rb') as manifest:
+        manifest.seek(0, os.SEEK_END)
+        position = manifest.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= number:
+            step = min(MANIFEST_BLOCK_SIZE, position)
+            position -= step
+            manifest.seek(position)
+            data = manifest.read(step) + data
+    lines = data.split(b'\n')
+    if position > 0:
+        lines = lines[1:]  # Probably only part of a line.
+    lines = [line for line in lines if line.strip()]
+    return [json.loads(line) for line in lines[-number:]]
+
+
+def _archive_page_filename(page_number, last_page_number):
+    if page_number == last_page_number:
+        return 'index.html'
+    return 'page-%s.html' % page_number
+
+
+def archive_page_entries(entries, page_number):
+    """Return the entries of one page out of all the manifest entries."""
+    return entries[page_number * ARCHIVE_PAGE_SIZE:
+                   (page_number + 1) * ARCHIVE_PAGE_SIZE]
+
+
+def write_archive_page(entries, page_number, last_page_number):
+    """Write one page of the archive index; page 0 has the oldest entries.
+
+    ``entries`` are the manifest entries of this page only.
+    """
+    page_entries = []
+    for entry in reversed(entries):
+        name = entry['name']
+        if os.path.isdir(os.path.join(ARCHIVEDIR, name)):
+            href = name + '/index.html'
+        elif os.path.exists(os.path.join(ARCHIVEDIR, name + '.tar.gz')):
+            href = name + '.tar.gz'
+        else:
+            href = None  # Removed by the retention policy.
+        page_entries.append({'name': name,
+                             'href': href,
+                             'summary': entry.get('summary', {})})
+    view = {'entries': page_entries, 'newer_page': None, 'older_page': None}
+    if page_number < last_page_number:
+        view['newer_page'] = _archive_page_filename(page_number + 1,
+                                                    last_page_number)
+    if page_number > 0:
+        view['older_page'] = _archive_page_filename(page_number - 1,
+                                                    last_page_number)
     template = jinja_env.get_template('archive.html')
-    outfile = os.path.join(ARCHIVEDIR, 'index.html')
-    view = {'archive_dirs': archive_dirs}
+    outfile = os.path.join(
+        ARCHIVEDIR, _archive_page_filename(page_number, last_page_number))
     static = '../'
-    open(outfile, 'w').write(template.render(
+    open(outfile + '.tmp', 'w').write(template.render(
         view=view,
         title='Archive of previous tests',
         static=static))
+    os.rename(outfile + '.tmp', outfile)
+
+
+def write_archive_pages(entries):
+    """Write all pages of the archive index and remove superfluous ones.
+
+    Needed when entries are removed from the manifest: every entry after
+    them moves.
+    """
+    last_page_number = max(0, (len(entries) - 1) // ARCHIVE_PAGE_SIZE)
+    for page_number in range(last_page_number + 1):
+        write_archive_page(archive_page_entries(entries, page_number),
+                           page_number, last_page_number)
+    for filename in glob.glob(os.path.join(ARCHIVEDIR, 'page-*.html')):
+        page_number = int(filename.split('page-')[-1].split('.')[0])
+        if page_number >= last_page_number:
+            os.remove(filename)
+
+
+def create_archive_index(summary=None):
+    """Add the current run to the archive manifest and update the index.
+
+    Only the newest page (``index.html``) is re-rendered, plus the page
+    before it when a new page has just been started. Only the entries of
+    those pages are read from the manifest, so this doesn't get slower when
+    the archive grows.
+    """
+    length = archive_manifest_length()
+    name = os.path.basename(TIMESTAMPED_OUTDIR)
+    if name not in [entry['name'] for entry in read_archive_tail(1)]:
+        append_archive_entry({'name': name, 'summary': summary or {}})
+        length += 1
+    last_page_number = (length - 1) // ARCHIVE_PAGE_SIZE
+    page_numbers = [last_page_number]
+    if last_page_number > 0 and length % ARCHIVE_PAGE_SIZE == 1:
+        # The previous page used to be index.html.
+        page_numbers.insert(0, last_page_number - 1)
+    first_index = page_numbers[0] * ARCHIVE_PAGE_SIZE
+    entries = read_archive_tail(length - first_index)
+    for page_number in page_numbers:
+        start = page_number * ARCHIVE_PAGE_SIZE - first_index
+        write_archive_page(entries[start:start + ARCHIVE_PAGE_SIZE],
+                           page_number, last_page_number)
+
+
+def compaction_due(interval=ARCHIVE_COMPACT_INTERVAL):
+    """Return whether the last compact_archive() was longer ago than that.
+    """
+    if not os.path.exists(ARCHIVE_COMPACT_STAMP):
+        return True
+    last_compaction = datetime.datetime.fromtimestamp(
+        os.path.getmtime(ARCHIVE_COMPACT_STAMP))
+    return datetime.datetime.now() - last_compaction > interval
+
+
+def compact_archive(max_age_days=ARCHIVE_MAX_AGE_DAYS):
+    """Replace archive directories older than max_age_days by a .tar.gz.
+
+    The archive index pages that link to them are re-rendered.
+    """
+    entries = read_archive_manifest()
+    too_old = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    changed_pages = set()
+    for index, entry in enumerate(entries):
+        name = entry['name']
+        archive_dir = os.path.join(ARCHIVEDIR, name)
+        if not os.path.isdir(archive_dir):
+            continue
+        try:
+            created = datetime.datetime.strptime(name, '%Y-%m-%d_%H%M')
+        except ValueError:
+            logger.warn("Archive dir %s has no timestamp name", name)
+            continue
+        if created > too_old:
+            continue
+        logger.info("Compacting archive dir %s", name)
+        tar_filename = archive_dir + '.tar.gz'
+        tar = tarfile.open(tar_filename + '.tmp', 'w:gz')
+        try:
+            tar.add(archive_dir, arcname=name)
+        finally:
+            tar.close()
+        os.rename(tar_filename + '.tmp', tar_filename)
+        shutil.rmtree(archive_dir)
+        changed_pages.add(index // ARCHIVE_PAGE_SIZE)
+    last_page_number = (len(entries) - 1) // ARCHIVE_PAGE_SIZE
+    for page_number in sorted(changed_pages):
+        write_archive_page(archive_page_entries(entries, page_number),
+                           page_number, last_page_number)
+    with open(ARCHIVE_COMPACT_STAMP, 'w') as stamp:
+        stamp.write(datetime.datetime.now().isoformat())
 
 
 def main():
@@ -1151,6 +1792,8 @@ def main():
                         default=None,
                         help="testcase to run (like 4_09_07)")
     parser.add_argument('--verbose', default=False, action='store_true')
+    parser.add_argument('--compact', default=False, action='store_true',
+                        help="compact old archive dirs (otherwise daily)")
     args = parser.parse_args()
     report = Report()
     logging.basicConfig(level=logging.DEBUG)
@@ -1160,4 +1803,6 @@ def main():
         run_subgrid_simulation(mdu_filepath, mdu_report=report,
                                verbose=args.verbose)
     report.export_reports()
-    create_archive_index()
+    create_archive_index(summary=report.summary_counts())
+    if args.compact or compaction_due():
+        compact_archive()
@@ -4,19 +4,30 @@ from __future__ import absolute_import, division
 from __future__ import print_function, unicode_literals
 from collections import OrderedDict
 import itertools
+import json
 import logging
+import re
 
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.db.models import Count
 from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext as _
+from django.views.decorators.http import condition
 from django.views.generic.base import TemplateView
 
+from threedi_verification import logstore
+from threedi_verification import pagecache
+from threedi_verification import performance
+from threedi_verification import regressions
 from threedi_verification.models import LibraryVersion
 from threedi_verification.models import TestCase
 from threedi_verification.models import TestRun
+from threedi_verification.models import run_counts
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +47,56 @@ class BaseView(TemplateView):
         return context
 
 
-class HomeView(BaseView):
+def load_crash_reports(test_runs):
+    """Load the deferred reports of the crashed test runs in one query.
+
+    The lists only show the log summary of crashed test runs, so the other
+    reports aren't loaded at all.
+    """
+    crashed = dict((test_run.id, test_run) for test_run in test_runs
+                   if test_run.has_crashed)
+    rows = TestRun.objects.filter(id__in=list(crashed)).values_list(
+        'id', 'report')
+    for id, report in rows:
+        if isinstance(report, basestring):
+            # values() gives us the raw json of a JSONField.
+            report = json.loads(report)
+        crashed[id].report = report
+    return test_runs
+
+
+def page_etag(request, *args, **kwargs):
+    return pagecache.etag(request.get_full_path())
+
+
+def page_last_modified(request, *args, **kwargs):
+    return pagecache.last_modified()
+
+
+class CachedPageMixin(object):
+    """Serve the rendered page from the cache until the data changes.
+
+    The ETag and Last-Modified headers let browsers revalidate for free.
+    """
+
+    @method_decorator(condition(etag_func=page_etag,
+                                last_modified_func=page_last_modified))
+    def dispatch(self, request, *args, **kwargs):
+        # Determine the key before rendering: a page rendered from data that
+        # changed meanwhile must not end up under the new generation.
+        key = pagecache.page_key(request.get_full_path())
+        content = pagecache.get_page(key)
+        if content is not None:
+            return HttpResponse(content)
+        response = super(CachedPageMixin, self).dispatch(
+            request, *args, **kwargs)
+        if response.status_code == 200:
+            response.render()
+            pagecache.set_page(key, response.content)
+        return response
+
+
+class HomeView(CachedPageMixin, BaseView):
     template_name = 'threedi_verification/home.html'
     subtitle = _("overview")
 
@@ -47,11 +107,19 @@ class HomeView(BaseView):
     @cached_property
     def latest_test_runs(self):
         active_runs = TestRun.objects.filter(
-            test_case_version__test_case__is_active=True)
+            test_case_version__test_case__is_active=True).select_related(
+                'test_case_version__test_case', 'library_version').defer(
+                    'report')
         return active_runs[:5]
 
+    @cached_property
+    def performance_regressions(self):
+        if self.latest_library_version is None:
+            return []
+        return performance.detect(self.latest_library_version)[:10]
+
 
-class LibraryVersionsView(BaseView):
+class LibraryVersionsView(CachedPageMixin, BaseView):
     template_name = 'threedi_verification/library_versions.html'
     title = _("Library versions")
     subtitle = _("newest at the top")
@@ -61,11 +129,27 @@ class LibraryVersionsView(BaseView):
     def back_link(self):
         return reverse('threedi_verification.home')
 
+    @cached_property
     def library_versions(self):
-        return LibraryVersion.objects.all().prefetch_related('test_runs')[:50]
-
-
-class LibraryVersionView(BaseView):
+        """Return the latest 50 library versions, with their run counts.
+
+        Two queries in total, regardless of the number of test runs.
+        """
+        library_versions = list(LibraryVersion.objects.annotate(
+            num_test_runs=Count('test_runs'))[:50])
+        counts = run_counts([library_version.id
+                             for library_version in library_versions])
+        older = {}
+        for library_version in reversed(library_versions):
+            # For the "compare with previous version" link.
+            library_version.previous = older.get(library_version.library)
+            older[library_version.library] = library_version
+        for library_version in library_versions:
+            library_version.run_counts = counts[library_version.id]
+        return library_versions
+
+
+class LibraryVersionView(CachedPageMixin, BaseView):
     template_name = 'threedi_verification/library_version.html'
     title = _("Library version")
     back_link_title = _("Back to library versions overview")
@@ -87,19 +171,45 @@ class LibraryVersionView(BaseView):
     @cached_property
     def all_test_runs(self):
         return self.library_version.test_runs.filter(
-            test_case_version__test_case__has_csv=True).order_by(
-                'test_case_version__test_case', '-run_started')
+            test_case_version__test_case__has_csv=True).select_related(
+                'test_case_version__test_case').defer('report').order_by(
+                    'test_case_version__test_case', '-run_started')
+
+    @cached_property
+    def timing_totals(self):
+        """Return the total and mean seconds per phase of all test runs.
+
+        The per-csv phases are taken together.
+        """
+        totals = OrderedDict()
+        num_test_runs = 0
+        for timing in self.library_version.test_runs.exclude(
+                timing=None).values_list('timing', flat=True):
+            if isinstance(timing, basestring):
+                timing = json.loads(timing)
+            if not timing:
+                continue
+            num_test_runs += 1
+            for span in timing:
+                name = span['name']
+                if name.startswith('csv '):
+                    name = 'csv (all)'
+                totals[name] = totals.get(name, 0) + span['seconds']
+        return [dict(name=name,
+                     seconds=seconds,
+                     mean_seconds=seconds / num_test_runs)
+                for name, seconds in totals.items()]
 
     @cached_property
     def crashed_test_runs(self):
-        return [test_run for test_run in self.all_test_runs
-                if test_run.has_crashed]
+        return load_crash_reports(
+            list(self.all_test_runs.filter(has_crashed=True)))
 
     # TODO: remove this function, is obsolete/unused!
     @cached_property
     def completed_test_runs(self):
-        test_runs = [test_run for test_run in self.all_test_runs
-                     if (not test_run.has_crashed) and test_run.duration]
+        test_runs = self.all_test_runs.filter(
+            has_crashed=False, duration__isnull=False).exclude(duration=0)
         per_test_case = OrderedDict()
         for test_case, group in itertools.groupby(
                 test_runs,
@@ -118,12 +228,16 @@ class LibraryVersionView(BaseView):
     @cached_property
     def _test_runs_by_category(self):
         """Grouped by category"""
-        test_runs = [test_run for test_run in self.all_test_runs
-                     if (not test_run.has_crashed) and test_run.duration]
-        # IMPORTANT: test_runs needs to be SORTED for groupby to work
-        test_runs.sort(
-            key=lambda test_run: test_run.test_case_version.test_case.category)
-        per_category = {}
+        # These are only shown with a progress bar, so no report needed. The
+        # database does the sorting, groupby only needs to walk the list.
+        test_runs = self.all_test_runs.filter(
+            has_crashed=False, duration__isnull=False).exclude(
+                duration=0).defer('report').order_by(
+                    'test_case_version__test_case__category',
+                    'test_case_version__test_case__pretty_name',
+                    'test_case_version__test_case',
+                    '-run_started')
+        per_category = OrderedDict()
         for category, group in itertools.groupby(
                 test_runs,
                 lambda testrun: testrun.test_case_version.test_case.category):
@@ -132,13 +246,49 @@ class LibraryVersionView(BaseView):
 
     @cached_property
     def test_runs_by_category(self):
-        d = {}
+        d = OrderedDict()
         for category, group in self._test_runs_by_category.items():
             d[category] = self.get_completed_test_runs(group)
         return d
 
 
-class TestCasesView(BaseView):
+class ComparisonView(CachedPageMixin, BaseView):
+    template_name = 'threedi_verification/comparison.html'
+    title = _("Comparison of library versions")
+    back_link_title = _("Back to library versions overview")
+
+    @property
+    def back_link(self):
+        return reverse('threedi_verification.library_versions')
+
+    @cached_property
+    def old_library_version(self):
+        return get_object_or_404(LibraryVersion, pk=self.kwargs['old'])
+
+    @cached_property
+    def new_library_version(self):
+        return get_object_or_404(LibraryVersion, pk=self.kwargs['new'])
+
+    @cached_property
+    def subtitle(self):
+        return '%s versus %s' % (self.new_library_version.last_modified,
+                                 self.old_library_version.last_modified)
+
+    @cached_property
+    def threshold(self):
+        try:
+            return float(self.request.GET.get('threshold'))
+        except (TypeError, ValueError):
+            return regressions.DEFAULT_THRESHOLD
+
+    @cached_property
+    def differences(self):
+        return regressions.compare(self.old_library_version.pk,
+                                   self.new_library_version.pk,
+                                   threshold=self.threshold)
+
+
+class TestCasesView(CachedPageMixin, BaseView):
     template_name = 'threedi_verification/test_cases.html'
     title = _("Test cases")
     back_link_title = _("Back to home")
@@ -148,7 +298,14 @@ class TestCasesView(BaseView):
         return reverse('threedi_verification.home')
 
     def test_cases(self):
-        return TestCase.objects.filter(is_active=True)
+        # The latest test run comes along in the same query, without its
+        # report: only crashed runs show (the log summary of) it.
+        test_cases = list(TestCase.objects.filter(
+            is_active=True).select_related('latest_run').defer(
+                'latest_run__report'))
+        load_crash_reports([test_case.latest_run for test_case in test_cases
+                            if test_case.latest_run is not None])
+        return test_cases
 
 
 class TestCaseView(BaseView):
@@ -169,15 +326,43 @@ class TestCaseView(BaseView):
 
     @cached_property
     def grouped_test_runs(self):
+        """Return the test runs per test case version, newest first.
+
+        All test runs come out of one query, without their reports.
+        """
+        test_runs = TestRun.objects.filter(
+            test_case_version__test_case=self.test_case).select_related(
+                'test_case_version', 'library_version').defer(
+                    'report').order_by('-test_case_version__last_modified',
+                                       'test_case_version', 'library_version')
         per_test_case_version = OrderedDict()
-        test_case_versions = self.test_case.test_case_versions.all().order_by(
-            '-last_modified')
-        for test_case_version in test_case_versions:
-            test_runs = test_case_version.test_runs.all().order_by(
-                'library_version')
-            per_test_case_version[test_case_version] = list(test_runs)
+        for test_run in load_crash_reports(list(test_runs)):
+            per_test_case_version.setdefault(
+                test_run.test_case_version, []).append(test_run)
         return per_test_case_version
 
+    @cached_property
+    def resource_history(self):
+        """Return the simulator's memory and cpu use per test run.
+
+        Oldest library version first, with percentages of the maximum for
+        drawing bars.
+        """
+        test_runs = list(TestRun.objects.filter(
+            test_case_version__test_case=self.test_case,
+            max_rss__isnull=False).select_related(
+                'library_version').defer('report').order_by(
+                    'library_version__last_modified', 'run_started'))
+        if not test_runs:
+            return []
+        max_rss = max(test_run.max_rss for test_run in test_runs) or 1
+        max_cpu_time = max(test_run.cpu_time for test_run in test_runs) or 1
+        return [dict(test_run=test_run,
+                     rss_percentage=int(100 * test_run.max_rss / max_rss),
+                     cpu_percentage=int(
+                         100 * test_run.cpu_time / max_cpu_time))
+                for test_run in test_runs]
+
 
 class TestRunView(BaseView):
     template_name = 'threedi_verification/test_run.html'
@@ -199,12 +384,59 @@ class TestRunView(BaseView):
 
     @cached_property
     def report(self):
-        return self.test_run.report
+        return self.test_run.full_report
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
 
 
 def plain_log(request, pk=None):
-    test_run = TestRun.objects.get(pk=pk)
-    crash_content = test_run.report.get('log')
-    regular_content = test_run.report.get('successfully_loaded_log')
-    content = crash_content or regular_content
-    return HttpResponse(content, content_type='text/plain')
+    """Stream the full log from the log store.
+
+    Supports a single http range (uncompressed bytes) and sends the gzipped
+    file as-is when the client accepts gzip. Old test runs still have the
+    full log in their report.
+    """
+    test_run = get_object_or_404(TestRun, pk=pk)
+    if not logstore.has_log(test_run.pk):
+        crash_content = test_run.report.get('log')
+        regular_content = test_run.full_report.get('successfully_loaded_log')
+        content = crash_content or regular_content
+        return HttpResponse(content, content_type='text/plain')
+
+    size = logstore.uncompressed_size(test_run.pk)
+    match = RANGE_RE.match(request.META.get('HTTP_RANGE', '').strip())
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # Suffix range: the last N bytes.
+            start = max(size - int(last), 0)
+            end = size - 1
+        if start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+        response = StreamingHttpResponse(
+            logstore.iter_log(test_run.pk, start=start, end=end),
+            status=206,
+            content_type='text/plain; charset=utf-8')
+        response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = StreamingHttpResponse(
+            logstore.iter_compressed(test_run.pk),
+            content_type='text/plain; charset=utf-8')
+        response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = str(
+            logstore.compressed_size(test_run.pk))
+    else:
+        response = StreamingHttpResponse(
+            logstore.iter_log(test_run.pk),
+            content_type='text/plain; charset=utf-8')
+        response['Content-Length'] = str(size)
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    return response
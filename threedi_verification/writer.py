@@ -0,0 +1,72 @@
+# (c) Nelen & Schuurmans.  GPL licensed, see LICENSE.txt.
+# -*- coding: utf-8 -*-
+"""Batched writing of finished test runs to the (sqlite) database.
+
+With sqlite, only one process can write at the same time. Committing every
+test run separately means lots of small write transactions that can collide
+with other processes ("database is locked"). The ResultWriter collects the
+finished test runs and writes a batch of them in one transaction.
+
+A batch is written when it is full or when its oldest test run has waited
+``RESULT_BATCH_SECONDS``. Until then the test runs have no report and no
+duration in the database: if the process dies, the pending test runs are
+lost and are simply run again by the next run_simulations.
+
+"""
+from __future__ import absolute_import, division
+from __future__ import print_function, unicode_literals
+import logging
+import time
+
+from django.conf import settings
+from django.db import OperationalError
+from django.db import transaction
+
+from threedi_verification import logstore
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+
+class ResultWriter(object):
+
+    def __init__(self, batch_size=None, max_seconds=None):
+        if batch_size is None:
+            batch_size = settings.RESULT_BATCH_SIZE
+        if max_seconds is None:
+            max_seconds = settings.RESULT_BATCH_SECONDS
+        self.batch_size = batch_size
+        self.max_seconds = max_seconds
+        self.pending = []
+        self.oldest_pending = None
+
+    def add(self, test_run, report, log=None):
+        """Queue a finished test run; the log is stored right away."""
+        logstore.store_log(test_run.id, log)
+        if not self.pending:
+            self.oldest_pending = time.time()
+        self.pending.append((test_run, report))
+        if (len(self.pending) >= self.batch_size or
+                time.time() - self.oldest_pending >= self.max_seconds):
+            self.flush()
+
+    def flush(self):
+        """Write all pending test runs in one transaction."""
+        if not self.pending:
+            return
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                with transaction.atomic():
+                    for test_run, report in self.pending:
+                        test_run.store_report(report)
+            except OperationalError:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                logger.warn("Database is busy, retrying to write %s test "
+                            "runs (attempt %s)", len(self.pending), attempt)
+                time.sleep(2 ** attempt)
+            else:
+                break
+        logger.info("Wrote %s test runs", len(self.pending))
+        self.pending = []